@@ -0,0 +1,10 @@
+"""
+Benchmarks of 1C reports converter.
+
+Generate reports:
+    python -m benchmarks.generate --rows 1000 100000 --formats xlsx xlsb
+Run converter on them and save timings:
+    python -m benchmarks.run ../bench_data --compare ../bench_results/old.json
+Measure startup time of converter:
+    python -m benchmarks.startup --repeat 20
+"""
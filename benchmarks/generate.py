@@ -0,0 +1,362 @@
+"""
+Generator of synthetic 1C account card reports in xlsx, xlsb and xls.
+xlsx files have the wrong xl/SharedStrings.xml member name as 1C
+writes it, xlsb files are written as minimal BIFF12 workbooks,
+xls files need xlwt and are limited to 65536 rows, xlsx and xlsb
+files to 1048576 rows.
+"""
+
+import os
+import random
+import struct
+import argparse
+from zipfile import ZipFile, ZIP_DEFLATED
+from xml.sax.saxutils import escape
+
+COLUMNS = 10
+XLS_MAX_ROWS = 65536
+XLSX_MAX_ROWS = 1048576
+# sheet rows per record: record row and continuation row for 70% of them
+ROWS_PER_RECORD = 1.7
+
+ACCOUNT_PAIRS = [(281, 632), (632, 361), (361, 702), (311, 361), (632, 311),
+                 (201, 632), (632, 718), (312, 632), (999, 632), (632, 714)]
+CURRENCIES = ['USD', 'EUR', 'PLN']
+
+
+def report_rows(rows, seed=0, date_column='Період'):
+    """
+    Rows of 1C account card report: title, header with 'Документ',
+    'Показник' row, records of two rows and footer
+    :param rows: approximate number of rows
+    :param seed: random seed
+    :param date_column: name of date column, 'Період' or 'Дата'
+    :return: generator of lists of cell values, None for empty cell
+    """
+    rnd = random.Random(seed)
+    empty = [None] * COLUMNS
+
+    yield ['Картка рахунку'] + [None] * (COLUMNS - 1)
+    yield empty
+    yield [date_column, 'Документ', 'Аналітика Дт', 'Аналітика Кт',
+           'Дебет', None, 'Кредит', None, 'Поточне сальдо', None]
+    yield [None, None, None, None, 'Показник', None, 'Показник', None,
+           None, None]
+    yield ['Сальдо на початок', None, None, None, None, None, None, None,
+           'Д', 1000.25]
+
+    saldo = 1000.25
+    for k in range(max(int(rows / ROWS_PER_RECORD), 1)):
+        debet, credit = rnd.choice(ACCOUNT_PAIRS)
+        amount = round(rnd.uniform(1, 100000), 2) + 0.01
+        if rnd.random() < 0.1:
+            amount = -amount
+        saldo = round(saldo + amount, 2)
+        day = f'{1 + k % 28:02d}.{1 + k // 28 % 12:02d}.2023'
+        yield [day,
+               f'Рахунок на оплату\n№ {k + 1} від {day}\n'
+               f'Контрагент {rnd.randint(1, 500)}',
+               f'Контрагент {rnd.randint(1, 500)}\n'
+               f'Договір № {rnd.randint(1, 50)}',
+               'Товари' if rnd.random() < 0.7 else 'Послуги',
+               debet, amount, credit, amount, 'Д', saldo]
+
+        kind = rnd.random()
+        if kind < 0.4:
+            currency = rnd.choice(CURRENCIES)
+            currency_amount = round(amount / 40, 2) + 0.01
+            yield [None, None, None, None, currency, currency_amount,
+                   currency, currency_amount, None,
+                   round(saldo / 40, 2) + 0.01]
+        elif kind < 0.7:
+            yield empty
+
+    yield ['Обороти за період', None, None, None, None, 1.5, None, 1.5,
+           None, None]
+    yield ['Сальдо на кінець', None, None, None, None, None, None, None,
+           'Д', saldo]
+
+
+def column_letter(ind):
+    letters = ''
+    ind += 1
+    while ind:
+        ind, rest = divmod(ind - 1, 26)
+        letters = chr(65 + rest) + letters
+    return letters
+
+
+XLSX_CONTENT_TYPES = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>
+<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>
+<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>
+<Override PartName="/xl/sharedStrings.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"/>
+</Types>'''
+
+XLSX_RELS = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>
+</Relationships>'''
+
+XLSX_WORKBOOK = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">
+<sheets><sheet name="TDSheet" sheetId="1" r:id="rId1"/></sheets>
+</workbook>'''
+
+XLSX_WORKBOOK_RELS = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>
+<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>
+<Relationship Id="rId3" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/sharedStrings" Target="sharedStrings.xml"/>
+</Relationships>'''
+
+XLSX_STYLES = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">
+<fonts count="1"><font><sz val="10"/><name val="Arial"/></font></fonts>
+<fills count="1"><fill><patternFill patternType="none"/></fill></fills>
+<borders count="1"><border/></borders>
+<cellStyleXfs count="1"><xf/></cellStyleXfs>
+<cellXfs count="1"><xf xfId="0"/></cellXfs>
+<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>
+</styleSheet>'''
+
+
+def write_xlsx(path, rows):
+    """
+    Write rows to xlsx with xl/SharedStrings.xml member name as 1C does
+    """
+    strings = {}
+    with ZipFile(path, 'w', ZIP_DEFLATED) as container:
+        container.writestr('[Content_Types].xml', XLSX_CONTENT_TYPES)
+        container.writestr('_rels/.rels', XLSX_RELS)
+        container.writestr('xl/workbook.xml', XLSX_WORKBOOK)
+        container.writestr('xl/_rels/workbook.xml.rels', XLSX_WORKBOOK_RELS)
+        container.writestr('xl/styles.xml', XLSX_STYLES)
+
+        with container.open('xl/worksheets/sheet1.xml', 'w') as sheet:
+            sheet.write(b'<?xml version="1.0" encoding="UTF-8" '
+                        b'standalone="yes"?>\n<worksheet xmlns="http://'
+                        b'schemas.openxmlformats.org/spreadsheetml/2006/'
+                        b'main"><sheetData>')
+            for row_ind, row in enumerate(rows, 1):
+                cells = []
+                for col_ind, value in enumerate(row):
+                    if value is None:
+                        continue
+                    ref = f'{column_letter(col_ind)}{row_ind}'
+                    if isinstance(value, str):
+                        string_ind = strings.setdefault(value, len(strings))
+                        cells.append(f'<c r="{ref}" t="s">'
+                                     f'<v>{string_ind}</v></c>')
+                    else:
+                        cells.append(f'<c r="{ref}"><v>{value!r}</v></c>')
+                sheet.write(f'<row r="{row_ind}">{"".join(cells)}</row>'
+                            .encode('utf8'))
+            sheet.write(b'</sheetData></worksheet>')
+
+        with container.open('xl/SharedStrings.xml', 'w') as shared:
+            shared.write(f'<?xml version="1.0" encoding="UTF-8" '
+                         f'standalone="yes"?>\n<sst xmlns="http://schemas.'
+                         f'openxmlformats.org/spreadsheetml/2006/main" '
+                         f'count="{len(strings)}" '
+                         f'uniqueCount="{len(strings)}">'.encode('utf8'))
+            for value in strings:
+                shared.write(f'<si><t xml:space="preserve">{escape(value)}'
+                             f'</t></si>'.encode('utf8'))
+            shared.write(b'</sst>')
+
+
+XLSB_CONTENT_TYPES = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="bin" ContentType="application/vnd.ms-excel.sheet.binary.macroEnabled.main"/>
+<Override PartName="/xl/worksheets/sheet1.bin" ContentType="application/vnd.ms-excel.worksheet"/>
+<Override PartName="/xl/sharedStrings.bin" ContentType="application/vnd.ms-excel.sharedStrings"/>
+</Types>'''
+
+XLSB_RELS = XLSX_RELS.replace('workbook.xml', 'workbook.bin')
+
+XLSB_WORKBOOK_RELS = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.bin"/>
+<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/sharedStrings" Target="sharedStrings.bin"/>
+</Relationships>'''
+
+# BIFF12 record types
+BRT_ROW_HDR = 0x0000
+BRT_CELL_REAL = 0x0005
+BRT_CELL_ISST = 0x0007
+BRT_SST_ITEM = 0x0013
+BRT_BEGIN_BOOK = 0x0183
+BRT_END_BOOK = 0x0184
+BRT_BEGIN_SHEET = 0x0181
+BRT_END_SHEET = 0x0182
+BRT_BEGIN_BUNDLE_SHS = 0x018F
+BRT_END_BUNDLE_SHS = 0x0190
+BRT_BEGIN_SHEET_DATA = 0x0191
+BRT_END_SHEET_DATA = 0x0192
+BRT_WS_DIM = 0x0194
+BRT_BUNDLE_SH = 0x019C
+BRT_BEGIN_SST = 0x019F
+BRT_END_SST = 0x01A0
+
+
+def biff12_record(record_type, data=b''):
+    """
+    BIFF12 record: type bytes, length as 7-bit varint and data
+    """
+    header = bytearray(record_type.to_bytes(2, 'little')
+                       if record_type > 0x7F else bytes([record_type]))
+    length = len(data)
+    while True:
+        byte = length & 0x7F
+        length >>= 7
+        header.append(byte | (0x80 if length else 0))
+        if not length:
+            break
+    return bytes(header) + data
+
+
+def wide_string(value):
+    return struct.pack('<I', len(value)) + value.encode('utf-16-le')
+
+
+def write_xlsb(path, rows):
+    """
+    Write rows to minimal xlsb workbook with one sheet
+    """
+    strings = {}
+    with ZipFile(path, 'w', ZIP_DEFLATED) as container:
+        container.writestr('[Content_Types].xml', XLSB_CONTENT_TYPES)
+        container.writestr('_rels/.rels', XLSB_RELS)
+        container.writestr('xl/_rels/workbook.bin.rels', XLSB_WORKBOOK_RELS)
+        container.writestr('xl/workbook.bin', b''.join([
+            biff12_record(BRT_BEGIN_BOOK),
+            biff12_record(BRT_BEGIN_BUNDLE_SHS),
+            biff12_record(BRT_BUNDLE_SH, struct.pack('<II', 0, 1)
+                          + wide_string('rId1') + wide_string('TDSheet')),
+            biff12_record(BRT_END_BUNDLE_SHS),
+            biff12_record(BRT_END_BOOK)]))
+
+        rows = list(rows) if not isinstance(rows, list) else rows
+        with container.open('xl/worksheets/sheet1.bin', 'w') as sheet:
+            sheet.write(biff12_record(BRT_BEGIN_SHEET))
+            sheet.write(biff12_record(BRT_WS_DIM, struct.pack(
+                '<IIII', 0, len(rows) - 1, 0, COLUMNS - 1)))
+            sheet.write(biff12_record(BRT_BEGIN_SHEET_DATA))
+            for row_ind, row in enumerate(rows):
+                records = [biff12_record(BRT_ROW_HDR, struct.pack(
+                    '<IIHBBBI', row_ind, 0, 300, 0, 0, 0, 0))]
+                for col_ind, value in enumerate(row):
+                    if value is None:
+                        continue
+                    if isinstance(value, str):
+                        string_ind = strings.setdefault(value, len(strings))
+                        records.append(biff12_record(
+                            BRT_CELL_ISST,
+                            struct.pack('<III', col_ind, 0, string_ind)))
+                    else:
+                        records.append(biff12_record(
+                            BRT_CELL_REAL,
+                            struct.pack('<IId', col_ind, 0, value)))
+                sheet.write(b''.join(records))
+            sheet.write(biff12_record(BRT_END_SHEET_DATA))
+            sheet.write(biff12_record(BRT_END_SHEET))
+
+        with container.open('xl/sharedStrings.bin', 'w') as shared:
+            shared.write(biff12_record(BRT_BEGIN_SST, struct.pack(
+                '<II', len(strings), len(strings))))
+            for value in strings:
+                shared.write(biff12_record(BRT_SST_ITEM,
+                                           b'\x00' + wide_string(value)))
+            shared.write(biff12_record(BRT_END_SST))
+
+
+def write_xls(path, rows):
+    """
+    Write rows to xls, needs xlwt
+    """
+    import xlwt
+
+    book = xlwt.Workbook(encoding='cp1251')
+    sheet = book.add_sheet('TDSheet')
+    for row_ind, row in enumerate(rows):
+        if row_ind >= XLS_MAX_ROWS:
+            raise ValueError(f'xls file cannot have more than '
+                             f'{XLS_MAX_ROWS} rows')
+        for col_ind, value in enumerate(row):
+            if value is not None:
+                sheet.write(row_ind, col_ind, value)
+    book.save(path)
+
+
+WRITERS = {'.xlsx': write_xlsx, '.xlsb': write_xlsb, '.xls': write_xls}
+MAX_ROWS = {'.xlsx': XLSX_MAX_ROWS, '.xlsb': XLSX_MAX_ROWS,
+            '.xls': XLS_MAX_ROWS}
+
+
+def fits_format(rows, ext):
+    """
+    Check that report of given size fits sheet of format even if all
+    records have continuation rows
+    :param rows: approximate number of rows
+    :param ext: extension of report file
+    :return: bool
+    """
+    # title, header, 'Показник' and saldo rows, two footer rows
+    sheet_rows = 2 * max(int(rows / ROWS_PER_RECORD), 1) + 7
+    return sheet_rows <= MAX_ROWS[ext]
+
+
+def generate_report(path, rows, seed=0):
+    """
+    Generate report of given number of rows, format is taken from extension
+    :param path: report file
+    :param rows: approximate number of rows
+    :param seed: random seed
+    :return: path
+    """
+    ext = os.path.splitext(path)[1]
+    if ext not in WRITERS:
+        raise ValueError(f'Unknown report format {ext}')
+    WRITERS[ext](path, report_rows(rows, seed,
+                                   'Дата' if seed % 2 else 'Період'))
+    return path
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks.generate',
+        description='Generate synthetic 1C account card reports.')
+    parser.add_argument('--rows', nargs='+', type=int,
+                        default=[1000, 10000, 100000],
+                        help='Report sizes in rows, 1000 to 890000 for '
+                             'xlsx and xlsb, to 55000 for xls, larger '
+                             'reports are skipped')
+    parser.add_argument('--formats', nargs='+', default=['xlsx'],
+                        choices=['xlsx', 'xlsb', 'xls'])
+    parser.add_argument('--out', default='../bench_data',
+                        help='Folder for reports. Default is ../bench_data')
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    os.makedirs(args.out, exist_ok=True)
+    for rows in args.rows:
+        for report_format in args.formats:
+            path = os.path.join(args.out,
+                                f'card_{rows}_rows.{report_format}')
+            if not fits_format(rows, f'.{report_format}'):
+                print(f'Skip {path}: {report_format} is limited to '
+                      f'{MAX_ROWS["." + report_format]} rows')
+                continue
+            try:
+                generate_report(path, rows, args.seed)
+                print(f'Generated {path}')
+            except ImportError as e:
+                print(f'Skip {path}: {e}')
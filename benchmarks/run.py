@@ -0,0 +1,248 @@
+"""
+Benchmark runner: converts every report of data folder in a separate
+process and saves timings of read, processing and write steps and
+peak memory to JSON. Run from the folder with config.yaml.
+"""
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import subprocess
+import multiprocessing
+from collections import defaultdict
+
+from benchmarks.generate import generate_report, fits_format, \
+    XLSX_MAX_ROWS
+
+REPORT_EXTENSIONS = ('.xls', '.xlsx', '.xlsb')
+# slower cases are reported as regressions
+REGRESSION_THRESHOLD = 1.1
+
+
+def peak_rss_mb():
+    """
+    Peak resident memory of current process in MB
+    """
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes on linux, bytes on macOS
+        return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+    except ImportError:
+        import psutil
+        return psutil.Process().memory_info().peak_wset / (1024 * 1024)
+
+
+def timed(timings, name, func):
+    """
+    Wrap function to add its run time to timings[name]
+    """
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            timings[name] += time.perf_counter() - start
+    return wrapper
+
+
+def run_case(report_path, stream_chunk_rows=0, compact=False,
+             output_format='xlsx'):
+    """
+    Convert one report and measure steps, runs in a fresh process
+    :param report_path: report file
+    :param stream_chunk_rows: chunk size of streaming mode, 0 - batch mode
+    :param compact: use memory-lean types of result columns
+    :param output_format: xlsx, csv, parquet or feather
+    :return: dict of measurements
+    """
+    import main
+
+    main.set_logger(main.logger, 'ERROR')
+    main.config['COMPACT_DTYPES'] = compact
+    main.config['OUTPUT_FORMAT'] = output_format
+    # timings must not depend on layouts cached by previous runs
+    main.config['LAYOUT_CACHE_FILE'] = ''
+    # benchmark reports must not get to production parsed cache and store
+    main.config['PARSED_CACHE_FOLDER'] = ''
+    main.config['STORE_FILE'] = ''
+    timings = defaultdict(float)
+    main.read_file_to_dataframe = timed(timings, 'read',
+                                        main.read_file_to_dataframe)
+    main.write_result_file = timed(timings, 'write', main.write_result_file)
+
+    ext = os.path.splitext(report_path)[1]
+    os.makedirs(main.TMP_FOLDER, exist_ok=True)
+    out_dir = tempfile.mkdtemp(prefix='bench_', dir=main.TMP_FOLDER)
+    result_file = os.path.join(out_dir, os.path.basename(report_path))
+
+    start = time.perf_counter()
+    source = report_path
+    if ext != '.xls':
+        fix_start = time.perf_counter()
+        source = main.fix_xlsx_container(report_path,
+                                         in_memory=not stream_chunk_rows)
+        timings['fix'] += time.perf_counter() - fix_start
+
+    if stream_chunk_rows and ext == '.xlsx':
+        # reading is interleaved with processing in streaming mode
+        main.stream_dataframe_processing(source, result_file,
+                                         stream_chunk_rows)
+        timings['read'] = None
+    else:
+        main.dataframe_processing(source, result_file)
+    total = time.perf_counter() - start
+
+    main.delete_tmp_folder(out_dir)
+    os.rmdir(out_dir)
+
+    process = total - timings['fix'] - timings['write'] - \
+        (timings['read'] or 0)
+    return {'file': os.path.basename(report_path),
+            'format': ext[1:],
+            'size_bytes': os.path.getsize(report_path),
+            'stream_chunk_rows': stream_chunk_rows,
+            'compact': compact,
+            'output_format': output_format,
+            'fix_s': round(timings['fix'], 4),
+            'read_s': None if timings['read'] is None
+            else round(timings['read'], 4),
+            'process_s': round(process, 4),
+            'write_s': round(timings['write'], 4),
+            'total_s': round(total, 4),
+            'peak_rss_mb': round(peak_rss_mb(), 1)}
+
+
+def run_isolated(report_path, stream_chunk_rows, compact, output_format):
+    """
+    Run case in a new process, so peak memory is measured per report
+    """
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(1) as pool:
+        try:
+            return pool.apply(run_case,
+                              (report_path, stream_chunk_rows, compact,
+                               output_format))
+        except Exception as e:
+            return {'file': os.path.basename(report_path),
+                    'stream_chunk_rows': stream_chunk_rows,
+                    'compact': compact,
+                    'output_format': output_format,
+                    'error': f'{e.__class__.__name__}: {e}'}
+
+
+def environment():
+    """
+    Versions of python, libraries and converter code
+    """
+    import pandas as pd
+    import numpy as np
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                                capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {'commit': commit,
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count()}
+
+
+def compare(results, previous_file):
+    """
+    Print total time and memory ratios to previous results
+    """
+    with open(previous_file, 'rt', encoding='utf8') as f:
+        previous = {(case['file'], case['stream_chunk_rows']): case
+                    for case in json.load(f)['results']}
+
+    for case in results:
+        old = previous.get((case['file'], case['stream_chunk_rows']))
+        if old is None or 'error' in case or 'error' in old:
+            continue
+        time_ratio = case['total_s'] / old['total_s'] if old['total_s'] \
+            else 1.0
+        memory_ratio = case['peak_rss_mb'] / old['peak_rss_mb'] \
+            if old['peak_rss_mb'] else 1.0
+        mark = ' REGRESSION' if max(time_ratio, memory_ratio) > \
+            REGRESSION_THRESHOLD else ''
+        print(f'{case["file"]}: time x{time_ratio:.2f}, '
+              f'memory x{memory_ratio:.2f}{mark}')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks.run',
+        description='Measure conversion of reports.')
+    parser.add_argument('data', nargs='?', default='../bench_data',
+                        help='Folder with reports. Default is ../bench_data')
+    parser.add_argument('--generate', nargs='+', type=int, default=[],
+                        metavar='ROWS',
+                        help='Generate xlsx reports of given sizes first')
+    parser.add_argument('--stream', type=int, default=0,
+                        dest='stream_chunk_rows',
+                        help='Chunk size for streaming mode, '
+                             'default is batch mode')
+    parser.add_argument('--compact', action='store_true',
+                        help='Use memory-lean types of result columns')
+    parser.add_argument('--output-format', default='xlsx',
+                        choices=['xlsx', 'csv', 'parquet', 'feather'],
+                        help='Format of result files. Default is xlsx')
+    parser.add_argument('--output', default=None,
+                        help='Results file. Default is '
+                             '../bench_results/bench_<time>.json')
+    parser.add_argument('--compare', default=None,
+                        help='Previous results file to compare with')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+
+    os.makedirs(args.data, exist_ok=True)
+    for rows in args.generate:
+        path = os.path.join(args.data, f'card_{rows}_rows.xlsx')
+        if not fits_format(rows, '.xlsx'):
+            print(f'Skip {path}: xlsx is limited to {XLSX_MAX_ROWS} rows')
+            continue
+        generate_report(path, rows)
+
+    reports = sorted(
+        (os.path.join(args.data, name) for name in os.listdir(args.data)
+         if name.endswith(REPORT_EXTENSIONS)),
+        key=os.path.getsize)
+
+    results = []
+    for report in reports:
+        case = run_isolated(report, args.stream_chunk_rows, args.compact,
+                            args.output_format)
+        results.append(case)
+        if 'error' in case:
+            print(f'{case["file"]}: failed, {case["error"]}')
+            continue
+        read = ('streamed' if case['read_s'] is None
+                else f'{case["read_s"]:.2f} s')
+        print(f'{case["file"]}: total {case["total_s"]:.2f} s, '
+              f'read {read}, process {case["process_s"]:.2f} s, '
+              f'write {case["write_s"]:.2f} s, '
+              f'peak {case["peak_rss_mb"]:.0f} MB')
+
+    output = args.output or os.path.join(
+        '../bench_results', time.strftime('bench_%Y%m%d_%H%M%S.json'))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'wt', encoding='utf8') as f:
+        json.dump({'environment': environment(), 'results': results}, f,
+                  ensure_ascii=False, indent=2)
+    print(f'Results are saved to {output}')
+
+    if args.compare:
+        compare(results, args.compare)
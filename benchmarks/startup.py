@@ -0,0 +1,124 @@
+"""
+Startup benchmark: time of a new interpreter to import the converter
+and to parse command line, as it is started by scheduler for every file.
+Commands are run from a temporary folder to check that the converter
+does not depend on the current folder.
+"""
+
+import os
+import sys
+import json
+import argparse
+import tempfile
+import statistics
+import subprocess
+import time
+
+from benchmarks.run import environment
+
+MAIN_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MAIN_SCRIPT = os.path.join(MAIN_FOLDER, 'main.py')
+
+# name: python arguments
+CASES = {'python': ['-c', 'pass'],
+         'import': ['-c', 'import main'],
+         'help': [MAIN_SCRIPT, '--help']}
+# modules that must not be imported at startup
+LAZY_MODULES = ('xlrd', 'pyxlsb', 'openpyxl', 'tabulate', 'xlsxwriter')
+
+
+def run_python(arguments, cwd):
+    """
+    Run python with PYTHONPATH of converter
+    :return: completed process
+    """
+    env = dict(os.environ, PYTHONPATH=MAIN_FOLDER)
+    return subprocess.run([sys.executable] + arguments, cwd=cwd, env=env,
+                          capture_output=True, text=True, check=True)
+
+
+def time_case(arguments, repeat, cwd):
+    """
+    Wall time of command runs in seconds
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run_python(arguments, cwd)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def import_profile(cwd, top):
+    """
+    Slowest imports of converter module by -X importtime
+    :return: list of (module, cumulative seconds) and loaded lazy modules
+    """
+    code = ('import sys, main; print(",".join(m for m in %r '
+            'if m in sys.modules))' % (LAZY_MODULES,))
+    process = run_python(['-X', 'importtime', '-c', code], cwd)
+
+    modules = []
+    for line in process.stderr.splitlines():
+        # import time: self [us] | cumulative [us] | imported package,
+        # nested imports are indented by 2 spaces
+        parts = line.split('|')
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        name = parts[2].rstrip()
+        # imports of main module
+        if len(name) - len(name.lstrip()) == 3:
+            modules.append((name.strip(), int(parts[1]) / 1e6))
+
+    modules.sort(key=lambda module: module[1], reverse=True)
+    loaded = [m for m in process.stdout.strip().split(',') if m]
+    return modules[:top], loaded
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Measure startup time of the converter.')
+    parser.add_argument('--repeat', type=int, default=10,
+                        help='Runs of every command. Default is 10')
+    parser.add_argument('--top', type=int, default=10,
+                        help='Number of slowest imports to show. '
+                             'Default is 10')
+    parser.add_argument('--output', default=None,
+                        help='Save results to JSON file')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory(prefix='startup_') as cwd:
+        for name, arguments in CASES.items():
+            times = time_case(arguments, args.repeat, cwd)
+            results[name] = {'min_s': round(min(times), 4),
+                             'median_s': round(statistics.median(times), 4)}
+            print(f'{name}: min {min(times):.3f} s, '
+                  f'median {statistics.median(times):.3f} s')
+
+        modules, loaded = import_profile(cwd, args.top)
+
+    print('Slowest imports:')
+    for module, seconds in modules:
+        print(f'  {module}: {seconds:.3f} s')
+    if loaded:
+        print(f'Loaded at startup, should be lazy: {", ".join(loaded)}')
+
+    if args.output:
+        output_folder = os.path.dirname(args.output)
+        if output_folder:
+            os.makedirs(output_folder, exist_ok=True)
+        with open(args.output, 'wt', encoding='utf8') as f:
+            json.dump({'environment': environment(),
+                       'results': results,
+                       'imports': modules,
+                       'lazy_loaded': loaded}, f, indent=2)
+        print(f'Results are saved to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -3,19 +3,33 @@ Utility for processing xls, xlsx, xlsb files
 that comes from 1C program
 """
 
+import io
 import os
 import shutil
+import hashlib
+import json
+import signal
+import struct
+import tempfile
+import threading
 from zipfile import ZipFile
 import time
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, \
+    as_completed
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+import sys
 from sys import exit
+from itertools import islice, product
 import argparse
+import datetime
+import re
+from functools import lru_cache
 import logging
-import xlrd
 import yaml
 import numpy as np
 import pandas as pd
-from tabulate import tabulate
-from dateutil.parser import parse
 
 
 class CustomFormatter(logging.Formatter):
@@ -41,18 +55,148 @@ class CustomFormatter(logging.Formatter):
         return formatter.format(record)
 
 
+class LazyTable:
+    """
+    Dataframe rows for debug log, table is rendered only
+    when the log record is really written
+    """
+
+    def __init__(self, data_df, rows=10):
+        self.data_df = data_df
+        self.rows = rows
+
+    def __str__(self):
+        from tabulate import tabulate
+        return tabulate(self.data_df.head(self.rows), tablefmt='psql')
+
+
 # Create a custom logger
 logger = logging.getLogger(__name__)
 
-with open('config.yaml', 'rt', encoding='utf8') as f:
-    config = yaml.load(f, Loader=yaml.FullLoader)
+# config, categories and relative folders of config are taken
+# from the folder of script, it may be started from any folder
+BASE_FOLDER = os.path.dirname(os.path.abspath(__file__))
+CONFIG_FILE = os.path.join(BASE_FOLDER, 'config.yaml')
+
+with open(CONFIG_FILE, 'rt', encoding='utf8') as f:
+    # libyaml loader is several times faster if it is installed
+    config = yaml.load(f, Loader=getattr(yaml, 'CFullLoader',
+                                         yaml.FullLoader))
+
 
-TMP_FOLDER = str(os.path.join(config['TMP_FOLDER']))
-RESULT_FILES_FOLDER = str(os.path.join(config['RESULT_FILES_FOLDER']))
-SOURCE_FILES_FOLDER = str(os.path.join(config['SOURCE_FILES_FOLDER']))
-CONVERTED_FILES_FOLDER = str(os.path.join(config['CONVERTED_FILES_FOLDER']))
+def config_path(path):
+    """
+    Path from config relative to the folder of script
+    """
+    return os.path.normpath(os.path.join(BASE_FOLDER, path))
+
+
+TMP_FOLDER = config_path(config['TMP_FOLDER'])
+RESULT_FILES_FOLDER = config_path(config['RESULT_FILES_FOLDER'])
+SOURCE_FILES_FOLDER = config_path(config['SOURCE_FILES_FOLDER'])
+CONVERTED_FILES_FOLDER = config_path(config['CONVERTED_FILES_FOLDER'])
 LOG_LEVEL = config['LOG_LEVEL']
 
+# excel 97-2003 compound file, zip container of xlsx and xlsb
+OLE2_SIGNATURE = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'
+ZIP_SIGNATURE = b'PK\x03\x04'
+XLSB_WORKBOOK = 'xl/workbook.bin'
+
+WRONG_SHARED_STRINGS = 'xl/SharedStrings.xml'
+CORRECT_SHARED_STRINGS = 'xl/sharedStrings.xml'
+# excel containers smaller than this are kept in memory only
+SPOOL_MAX_SIZE = 512 * 1024 * 1024
+COPY_BUFFER_SIZE = 1024 * 1024
+
+# dd.mm.yyyy with optional time, as 1C writes dates
+DATE_PATTERN = re.compile(r'^\s*(\d{1,2})\.(\d{1,2})\.(\d{2}|\d{4})'
+                          r'(?:\s+\d{1,2}:\d{2}(?::\d{2})?)?\s*$')
+DATE_CACHE_SIZE = 65536
+
+CATEGORIES_FILE = os.path.join(BASE_FOLDER, 'categories.conf')
+# accounts are packed to one int key: (debet * base + credit) * 2 + sign
+ACCOUNT_KEY_BASE = 10 ** 8
+
+# attempts to write locked result file
+WRITE_RETRIES = 3
+WRITE_RETRY_DELAY = 5
+
+SOURCE_EXTENSIONS = ('.xls', '.xlsx', '.xlsb')
+# watch mode: file is converted when its size and modification time
+# are not changed for WATCH_SETTLE_SECONDS
+WATCH_SETTLE_SECONDS = 2
+WATCH_POLL_INTERVAL = 0.5
+# with inotify idle folder is rescanned anyway after this time
+WATCH_IDLE_TIMEOUT = 60
+
+# consolidated store: seconds to wait for store locked by other worker
+STORE_TIMEOUT = 60
+# result columns kept in columns of store, names are keys of COLUMN_NAMES
+STORE_COLUMNS = ('debet', 'credit', 'sum_hrn_deb', 'sum_hrn_credit',
+                 'currency_deb', 'sum_currency_deb', 'currency_credit',
+                 'sum_currency_credit', 'operation')
+STORE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    source_file TEXT NOT NULL,
+    sheet TEXT NOT NULL,
+    period TEXT,
+    record_date TEXT,
+    debet INTEGER,
+    credit INTEGER,
+    sum_hrn_deb REAL,
+    sum_hrn_credit REAL,
+    currency_deb TEXT,
+    sum_currency_deb REAL,
+    currency_credit TEXT,
+    sum_currency_credit REAL,
+    operation TEXT,
+    data TEXT
+);
+CREATE INDEX IF NOT EXISTS records_source ON records (source_file);
+CREATE INDEX IF NOT EXISTS records_accounts ON records (debet, credit);
+CREATE INDEX IF NOT EXISTS records_operation ON records (operation);
+CREATE INDEX IF NOT EXISTS records_period ON records (period);
+CREATE TABLE IF NOT EXISTS totals (
+    operation TEXT NOT NULL,
+    debet INTEGER NOT NULL,
+    credit INTEGER NOT NULL,
+    sum_hrn_deb REAL NOT NULL,
+    sum_hrn_credit REAL NOT NULL,
+    records INTEGER NOT NULL,
+    PRIMARY KEY (operation, debet, credit)
+);
+CREATE TABLE IF NOT EXISTS sources (
+    source_file TEXT PRIMARY KEY,
+    records INTEGER NOT NULL,
+    stored TEXT NOT NULL
+);
+CREATE VIEW IF NOT EXISTS operation_totals AS
+    SELECT operation, TOTAL(sum_hrn_deb) AS sum_hrn_deb,
+           TOTAL(sum_hrn_credit) AS sum_hrn_credit,
+           SUM(records) AS records
+    FROM totals GROUP BY operation;
+"""
+
+# serve mode: buckets of request latency histogram in seconds
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+CONTENT_TYPES = {
+    'xlsx': 'application/vnd.openxmlformats-officedocument'
+            '.spreadsheetml.sheet',
+    'csv': 'text/csv; charset=utf-8',
+    'parquet': 'application/vnd.apache.parquet',
+    'feather': 'application/vnd.apache.arrow.file'}
+
+# rows of report head to find header and table start
+HEAD_ROWS = 30
+# sheet of result file with one report
+DEFAULT_SHEET = 'Sheet1'
+# rows to find columns of not numbers before all rows are checked
+ROLE_SAMPLE_ROWS = 1000
+# last rows of report to find table end
+TABLE_END_ROWS = 10
+# manifest of report in parsed cache
+PARSED_MANIFEST = 'report.json'
+
 
 def set_logger(loc_logger, logger_level):
     loc_logger.setLevel(logging.DEBUG)
@@ -77,514 +221,3652 @@ def parse_args():
                         choices=['ERROR', 'INFO', 'DEBUG', 'WARNING'],
                         help='Log levels: ERROR, INFO, DEBUG, WARNING. '
                              'Default is INFO')
+    parser.add_argument('-w', '--workers',
+                        type=int,
+                        default=1,
+                        dest='workers',
+                        help='Number of processes for files conversion. '
+                             'Default is 1')
+    parser.add_argument('-s', '--stream',
+                        type=int,
+                        default=config.get('STREAM_CHUNK_ROWS', 0),
+                        dest='stream_chunk_rows',
+                        help='Process xlsx files by chunks of given number '
+                             'of rows with bounded memory. '
+                             'Default is 0, whole file at once')
+    parser.add_argument('--no-cache',
+                        action='store_false',
+                        dest='use_cache',
+                        help='Convert all files again, do not use results '
+                             'of identical files from cache folder')
+    parser.add_argument('--pipeline',
+                        action='store_true',
+                        dest='pipeline',
+                        help='Read next files and write results while '
+                             'current files are converted, memory is '
+                             'limited by PIPELINE_MEMORY_MB of config')
+    parser.add_argument('--recategorize',
+                        action='store_true',
+                        dest='recategorize',
+                        help='Make results of all reports in '
+                             'PARSED_CACHE_FOLDER again with current '
+                             'categories and column names, source files '
+                             'are not read')
+    parser.add_argument('--watch',
+                        action='store_true',
+                        dest='watch',
+                        help='Watch source folder and convert new files '
+                             'until interrupted')
+    parser.add_argument('--serve',
+                        action='store_true',
+                        dest='serve',
+                        help='Run HTTP service converting uploaded reports, '
+                             'see SERVE_* settings of config')
+    parser.add_argument('--port',
+                        type=int,
+                        default=config.get('SERVE_PORT', 8080),
+                        dest='port',
+                        help='Port of HTTP service. Default is SERVE_PORT '
+                             'from config')
+    parser.add_argument('--profile',
+                        nargs='?',
+                        const=config_path(config.get('METRICS_FILE',
+                                                     '../metrics.jsonl')),
+                        default=None,
+                        dest='metrics_file',
+                        help='Write timings of processing stages, sizes and '
+                             'peak memory of every file as JSON lines. '
+                             'Default file is METRICS_FILE from config')
+    parser.add_argument('--profile-dump',
+                        default=None,
+                        dest='profile_dump_folder',
+                        help='Folder for cProfile stats of every file, '
+                             'works with --profile')
     return parser.parse_args()
 
 
-# Create tmp folder if not exists
-os.makedirs(TMP_FOLDER, exist_ok=True)
+# tmp folder of current process, every worker gets own subfolder
+work_tmp_folder = TMP_FOLDER
+
+# results of file being converted in pipeline mode, {result path: bytes},
+# they are written to result folder by the parent process
+result_buffers = None
+
+# metrics of file being converted, set by convert_file in profile mode,
+# sheets of file may update them from several threads
+file_metrics = None
+metrics_lock = threading.Lock()
+
+
+def init_worker(logger_level, config_overrides=None):
+    """
+    Initializer of worker process: logger, config and own tmp folder
+    :param logger_level: log level of parent process
+    :param config_overrides: config values set from command line
+    :return:
+    """
+    global work_tmp_folder
+
+    # parent process stops workers on Ctrl+C
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    if config_overrides:
+        config.update(config_overrides)
+
+    if not logger.handlers:
+        set_logger(logger, logger_level)
+
+    work_tmp_folder = tempfile.mkdtemp(prefix=f'worker_{os.getpid()}_',
+                                       dir=TMP_FOLDER)
+
+    # compile categories before the first file comes
+    get_category_rules()
+
+
+def fix_xlsx_container(xlsx_path, in_memory=True):
+    """
+    Copy excel container to spooled buffer and fix wrong
+    SharedStrings.xml member name in place.
+    Names have the same length, so only zip headers are patched
+    and no member is unpacked or compressed again.
+    :param xlsx_path: path to source excel file
+    :param in_memory: keep copy in memory up to SPOOL_MAX_SIZE,
+    otherwise copy to tmp folder
+    :return: file-like object positioned at the start
+    """
+    if in_memory:
+        buffer = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE,
+                                               dir=work_tmp_folder)
+    else:
+        buffer = tempfile.TemporaryFile(dir=work_tmp_folder)
+    with open(xlsx_path, 'rb') as src:
+        shutil.copyfileobj(src, buffer, COPY_BUFFER_SIZE)
+
+    return fix_shared_strings_name(buffer, xlsx_path)
+
 
+def fix_shared_strings_name(buffer, xlsx_name=''):
+    """
+    Fix wrong SharedStrings.xml member name of excel container in place
+    :param buffer: seekable readable and writable excel container
+    :param xlsx_name: name of file for log
+    :return: buffer positioned at the start
+    """
+    buffer.seek(0)
+    with ZipFile(buffer) as exl_container:
+        wrong_info = [info for info in exl_container.infolist()
+                      if info.filename == WRONG_SHARED_STRINGS]
+        central_dir_offset = exl_container.start_dir
+
+    if not wrong_info:
+        logger.debug(f'No {WRONG_SHARED_STRINGS} in {xlsx_name}')
+        buffer.seek(0)
+        return buffer
+
+    wrong_name = WRONG_SHARED_STRINGS.encode('utf8')
+    correct_name = CORRECT_SHARED_STRINGS.encode('utf8')
+
+    # local file header: name starts at offset 30
+    for info in wrong_info:
+        buffer.seek(info.header_offset + 30)
+        if buffer.read(len(wrong_name)) == wrong_name:
+            buffer.seek(info.header_offset + 30)
+            buffer.write(correct_name)
+
+    # central directory: fixed part of entry is 46 bytes
+    buffer.seek(central_dir_offset)
+    while True:
+        entry_offset = buffer.tell()
+        entry = buffer.read(46)
+        if len(entry) < 46 or entry[:4] != b'PK\x01\x02':
+            break
+        name_len, extra_len, comment_len = struct.unpack('<HHH',
+                                                         entry[28:34])
+        if buffer.read(name_len) == wrong_name:
+            buffer.seek(entry_offset + 46)
+            buffer.write(correct_name)
+        buffer.seek(entry_offset + 46 + name_len + extra_len + comment_len)
 
-def xlsx_processing(xlsx_file):
-    # file name without extension
-    base_file_name = os.path.splitext(os.path.basename(xlsx_file))[0]
+    logger.debug(f'Fixed {WRONG_SHARED_STRINGS} name in {xlsx_name}')
+    buffer.seek(0)
+    return buffer
 
-    base_name_without_spaces = base_file_name.replace(' ', '_')
 
-    # Распаковываем excel как zip в нашу временную папку
+def xlsx_processing(xlsx_file, source_format='.xlsx', data=None):
     logger.info(f'Start with file {xlsx_file}')
-    with ZipFile(os.path.join(SOURCE_FILES_FOLDER, xlsx_file)) as exl_container:
-        logger.debug(f'Start unpack file {xlsx_file}')
-        exl_container.extractall(TMP_FOLDER + '/' + base_name_without_spaces)
-        logger.debug(f'Finish unpack file {xlsx_file}')
-
-    # Переименовываем файл с неверным названием
-    wrong_file_path = os.path.join(TMP_FOLDER, base_name_without_spaces,
-                                   'xl',
-                                   'SharedStrings.xml')
-    logger.debug(f'Wrong_file_path: {os.path.abspath(wrong_file_path)}')
-    correct_file_path = os.path.join(TMP_FOLDER, base_name_without_spaces,
-                                     'xl',
-                                     'sharedStrings.xml_')
-    logger.debug(f'Correct_file_path: {os.path.abspath(correct_file_path)}')
-
-    # strange way for file renaming
-    if os.path.exists(os.path.abspath(wrong_file_path)):
-        shutil.move(os.path.abspath(wrong_file_path),
-                    os.path.abspath(correct_file_path))
-        shutil.move(os.path.abspath(correct_file_path),
-                    os.path.abspath(correct_file_path)[:-1])
-
-    logger.info(f'Creating new zip and renaming to {TMP_FOLDER}/{xlsx_file}')
-    try:
-        if os.path.exists(os.path.join(TMP_FOLDER, xlsx_file)):
-            os.remove(os.path.join(TMP_FOLDER, xlsx_file))
-        # Запаковываем excel обратно в zip и переименовываем в исходный файл
-        shutil.make_archive(os.path.join(TMP_FOLDER, base_file_name),
-                            'zip',
-                            os.path.join(TMP_FOLDER, base_name_without_spaces))
-        os.rename(os.path.join(TMP_FOLDER, base_file_name + '.zip'),
-                  os.path.join(TMP_FOLDER, xlsx_file))
 
+    chunk_rows = config.get('STREAM_CHUNK_ROWS', 0)
+    streaming = chunk_rows > 0 and source_format == '.xlsx'
+
+    # Исправляем название файла прямо в zip контейнере, без распаковки
+    try:
+        with measure_stage('fix'):
+            if data is not None:
+                exl_buffer = fix_shared_strings_name(io.BytesIO(data),
+                                                     xlsx_file)
+            else:
+                exl_buffer = fix_xlsx_container(
+                    os.path.join(SOURCE_FILES_FOLDER, xlsx_file),
+                    in_memory=not streaming)
     except Exception as e:
-        print("Error: %s." % e)
+        logger.error(f'Cannot fix container of {xlsx_file}. Error is {e}')
         return False
 
     try:
-        dataframe_processing(os.path.join(TMP_FOLDER, xlsx_file),
-                             os.path.join(RESULT_FILES_FOLDER, xlsx_file))
+        with exl_buffer:
+            if streaming:
+                stream_dataframe_processing(
+                    exl_buffer, os.path.join(RESULT_FILES_FOLDER, xlsx_file),
+                    chunk_rows, xlsx_file)
+            else:
+                dataframe_processing(
+                    exl_buffer, os.path.join(RESULT_FILES_FOLDER, xlsx_file),
+                    xlsx_file)
     except Exception as e:
-        logger.error(f'Error in data processing of {TMP_FOLDER}/{xlsx_file}.'
+        logger.error(f'Error in data processing of {xlsx_file}.'
                      f'Error is {e}')
         return False
 
     return True
 
 
-def dataframe_processing(source_file, result_file):
+def dataframe_processing(source_file, result_file, source_name=None):
 
-    ext = os.path.splitext(os.path.basename(xlsx_file))[1]
+    ext = os.path.splitext(os.path.basename(result_file))[1]
     result_file = result_file.replace(ext, '.xlsx')
 
-    df = read_file_to_dataframe(source_file)
-    logger.info(f'DataFrame processing of {source_file}')
+    # workbook is read once for all sheets
+    with measure_stage('read'):
+        book = read_file_to_dataframe(source_file, sheet_name=None)
+    sheets = report_sheets(book)
+    del book
+    if not sheets:
+        raise ValueError('Cannot read sheets of workbook')
+    set_metrics(sheets=len(sheets),
+                source_rows=sum(df.shape[0] for _, df in sheets),
+                source_columns=max(df.shape[1] for _, df in sheets))
+    logger.info(f'DataFrame processing for {result_file}')
+    source_name = source_name or os.path.basename(result_file)
+
+    parsed = open_parsed_report(source_name)
+    try:
+        results = process_sheets(sheets, layouts=get_layout_cache(),
+                                 parsed=parsed)
+        del sheets
+
+        results = [(sheet_name, lambda data_df=data_df: [data_df])
+                   for sheet_name, data_df in results]
+        with measure_stage('write'):
+            write_report_sheets(result_file, results)
+    except Exception:
+        if parsed is not None:
+            parsed.discard()
+        raise
+    if parsed is not None:
+        parsed.commit()
+    store_report(source_name, results)
+
+
+def report_sheets(book, config=config):
+    """
+    Choose sheets with report header
+    :param book: dict {sheet name: dataframe} of workbook
+    :param config: settings, config.yaml by default
+    :return: list of (sheet name, dataframe), the first sheet
+    if no sheet has report header
+    """
+    sheets = [(sheet_name, df) for sheet_name, df in book.items()
+              if has_report_header(df.head(HEAD_ROWS), config)]
+    if not sheets and book:
+        sheets = [next(iter(book.items()))]
+    return sheets
+
+
+def has_report_header(short_df, config=config):
+    """
+    Check HEADER_DETECTOR in the first rows of sheet
+    """
+    return bool(short_df.astype(str).eq(config['HEADER_DETECTOR'])
+                .to_numpy().any())
+
+
+def process_sheets(sheets, config=config, rules=None, layouts=None,
+                   parsed=None):
+    """
+    Make result dataframes of report sheets, several sheets
+    are processed in threads. Sheet without report table is skipped,
+    error is raised if no sheet is converted.
+    :param sheets: list of (sheet name, dataframe)
+    :param config: settings, config.yaml by default
+    :param rules: CategoryRules, categories.conf by default
+    :param layouts: LayoutCache or None
+    :param parsed: ParsedReport or None
+    :return: list of (sheet name, result dataframe)
+    """
+    def process_sheet(ind):
+        sheet_name, df = sheets[ind]
+        keep_parsed = None if parsed is None \
+            else parsed.sheet_writer(ind, sheet_name)
+        try:
+            return sheet_name, process_dataframe(df, config, rules, layouts,
+                                                 keep_parsed)
+        except Exception as e:
+            if len(sheets) == 1:
+                raise
+            # e.g. sheet of notes with header word but without records
+            logger.warning(f'Sheet {sheet_name} is skipped. Error is {e}')
+            if parsed is not None:
+                parsed.remove_sheet(ind)
+            return sheet_name, e
+
+    if len(sheets) == 1:
+        return [process_sheet(0)]
+
+    workers = min(len(sheets), config.get('SHEET_WORKERS') or
+                  os.cpu_count() or 1)
+    logger.info(f'Process {len(sheets)} sheets in {workers} threads')
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(process_sheet, range(len(sheets))))
+    return converted_sheets(results)
+
+
+def converted_sheets(results):
+    """
+    Leave results of converted sheets
+    :param results: list of (sheet name, result or exception)
+    :return: list of (sheet name, result)
+    """
+    converted = [(sheet_name, result) for sheet_name, result in results
+                 if not isinstance(result, Exception)]
+    if not converted:
+        raise ValueError('No sheet is converted. ' + '; '.join(
+            f'Sheet {sheet_name}: {result}'
+            for sheet_name, result in results))
+    return converted
 
-    short_df = df.head(30).copy(deep=True)
-    # short_df_tail = df.tail(30).copy(deep=True)
+
+def write_report_sheets(result_file, sheets):
+    """
+    Write results of report sheets. One sheet is written to Sheet1
+    of result file. Several sheets are written to sheets of one xlsx
+    or to result file per sheet by SHEETS_OUTPUT of config.
+    :param result_file: path of result file
+    :param sheets: list of (sheet name, function returning iterable
+    of result dataframes)
+    :return:
+    """
+    if len(sheets) == 1:
+        frames = sheets[0][1]
+        write_result_file(result_file, lambda: [(DEFAULT_SHEET, frames())])
+        return
+
+    if config.get('SHEETS_OUTPUT', 'combined') == 'combined':
+        if config.get('OUTPUT_FORMAT', 'xlsx') == 'xlsx':
+            write_result_file(result_file,
+                              lambda: [(sheet_name, frames())
+                                       for sheet_name, frames in sheets])
+            return
+        logger.info('Only xlsx keeps several sheets, '
+                    'result file is written per sheet')
+
+    root, ext = os.path.splitext(result_file)
+    for sheet_name, frames in sheets:
+        safe_name = re.sub(r'[\\/:*?"<>|]', '_', sheet_name)
+        write_result_file(f'{root}_{safe_name}{ext}',
+                          lambda frames=frames: [(DEFAULT_SHEET, frames())])
+
+
+def process_dataframe(df, config=config, rules=None, layouts=None,
+                      keep_parsed=None):
+    """
+    Make result dataframe of report sheet
+    :param df: report sheet read without header
+    :param config: settings, config.yaml by default
+    :param rules: CategoryRules, categories.conf by default
+    :param layouts: LayoutCache or None, detection of header
+    and columns is skipped for known templates
+    :param keep_parsed: function saving records before categorization
+    or None
+    :return: result dataframe
+    """
     logger.debug(f'df.columns: {df.columns}')
-    b = 0  # index for loop break: check for header, date and currencies columns
-    header_raw = 0
-    my_tb_start = []
 
     logger.debug('Find dataframe header and date column')
-    # find data frame structure
-    df = df.reset_index(drop=True)
-
     logger.debug('df.head(10):\n')
-    logger.debug(tabulate(df.head(10), tablefmt='psql'))
-
-    my_tb_start_j = -1
-
-    for i in range(short_df.shape[0]):  # iterate over rows
-        for j in short_df.columns:
-            value = short_df.loc[i, j]
-
-            # find header row
-            if config['HEADER_DETECTOR'] == str(value) and header_raw == 0:
-                header_raw = i
-                b = b + 1
-                logger.debug(f"header_raw: {header_raw}")
-                columns_list = short_df.iloc[header_raw]
-                if my_tb_start_j == -1:
-                    for ind, val in enumerate(columns_list):
-                        if val in config['DATE_COLUMN_IN']:
-                            my_tb_start_j = ind
-                            break
-                if b == 2:
-                    break
-
-            # try to convert cell value to date to check the start of data frame
-            if is_date(str(value)) and len(my_tb_start) == 0 and my_tb_start_j != -1 and df.columns.get_loc(j) == my_tb_start_j:
-                my_tb_start = [i, j]
-                b = b + 1
-                logger.debug(f"my_tb_start: {my_tb_start}")
-                if b == 2:
-                    break
-            elif is_date(str(value)) and len(my_tb_start) == 0 and my_tb_start_j == -1:
-                my_tb_start = [i, j]
-                b = b + 1
-                logger.debug(f"my_tb_start: {my_tb_start}")
-                if b == 2:
-                    break
-
-        if b == 2:
-            break
+    logger.debug(LazyTable(df))
+
+    # rows are taken by positions, so source dataframe is not copied
+    # to reset its index
+    with measure_stage('header'):
+        layout_key, layout = (None, None) if layouts is None \
+            else layouts.find(df.head(HEAD_ROWS), config)
+        if layout is not None:
+            header_raw, my_tb_start = layout_start(layout)
+        else:
+            header_raw, my_tb_start = find_table_start(df.head(HEAD_ROWS),
+                                                       config)
+        my_tb_end = find_table_end(df[my_tb_start[1]])
+    logger.debug(f"header_raw: {header_raw}")
+    logger.debug(f"my_tb_start: {my_tb_start}")
+    logger.debug(f"my_tb_end: {my_tb_end}")
+    header = df.iloc[header_raw].tolist()
+
+    # table rows starting with first row that contains date in cell,
+    # slice is a view, rows are copied once by pairing
+    data_df = df.iloc[my_tb_start[0]:my_tb_end]
+    del df
 
-    col_one_list = df[my_tb_start[1]].tolist()[-10:]
+    with measure_stage('pairing'):
+        data_df_even, data_df_odd = split_records(data_df, header,
+                                                  my_tb_start[1], config)
+    del data_df
+    add_metrics(records=data_df_even.shape[0])
+
+    with measure_stage('classification'):
+        if layout is not None and layout_matches(
+                data_df_even, data_df_odd, layout_roles(layout), config):
+            column_roles = layout_roles(layout)
+            set_metrics(layout='cached')
+        else:
+            column_roles = detect_column_roles(data_df_even, data_df_odd,
+                                               config)
+            if layout_key is not None:
+                layouts.put(layout_key, header_raw, my_tb_start,
+                            column_roles)
+            set_metrics(layout='detected')
+
+    with measure_stage('build'):
+        data_df_even = build_result_frame(data_df_even, data_df_odd,
+                                          column_roles, config)
+        data_df_even.dropna(axis='columns', how='all', inplace=True)
+    if keep_parsed is not None:
+        with measure_stage('parsed'):
+            keep_parsed(data_df_even)
 
-    # iterate over rows from the end
-    for i, elem in enumerate(col_one_list[::-1]):
-        if is_date(str(elem)):
-            if pd.isna(col_one_list[len(col_one_list) - i]):
-                my_tb_end = df.shape[0] - i + 1
-            else:
-                my_tb_end = df.shape[0] - i
-            logger.debug(f"my_tb_end: {my_tb_end}")
-            break
+    logger.debug('data_df_even.head(10):')
+    logger.debug(LazyTable(data_df_even))
+    logger.debug('data_df_even.columns:')
+    logger.debug(data_df_even.columns)
+    logger.debug('data_df_odd.head(10):')
+    logger.debug(LazyTable(data_df_odd))
+    logger.debug('data_df_odd.dtypes:')
+    logger.debug(data_df_odd.dtypes)
+    logger.debug('data_df_odd.columns:')
+    logger.debug(data_df_odd.columns)
 
-    # copy all columns form original data frame to data_df dataframe
-    # starting with first row that contains date in cell
-    data_df = df[my_tb_start[0]:my_tb_end].copy(
-        deep=True)
+    return finish_records(data_df_even, config, rules)
 
-    # footer_df = df[my_tb_end:].copy(
-    #     deep=True)
 
-    del df
+def finish_records(data_df_even, config=config, rules=None):
+    """
+    Add operations to records and divide text columns
+    :param data_df_even: result dataframe without operation column
+    :param config: settings, config.yaml by default
+    :param rules: CategoryRules, categories.conf by default
+    :return: result dataframe
+    """
+    with measure_stage('categories'):
+        data_df_even = categorize_records(data_df_even, config, rules)
+    if config.get('COMPACT_DTYPES'):
+        with measure_stage('compact'):
+            data_df_even = compact_dtypes(data_df_even, config)
+
+    # Divide strings in columns by \n character
+    with measure_stage('split'):
+        split_positions = text_split_candidates(data_df_even)
+        data_df_even = split_text_columns(
+            data_df_even,
+            count_text_parts(data_df_even, split_positions, config))
+    add_metrics(result_rows=data_df_even.shape[0])
+    set_metrics(result_columns=data_df_even.shape[1])
+
+    return data_df_even
+
 
-    data_df = data_df.reset_index(drop=True)
-
-    logger.debug('Insert empty rows')
-    # Insert empty rows if not exists
-    list_not_empty_rows = data_df[
-        data_df[my_tb_start[1]].notna()].index.tolist()
-    list_empty_rows = data_df[data_df[my_tb_start[1]].isna()].index.tolist()
-    list_empty_rows = [x - 1 for x in list_empty_rows]
-    list_to_insert = list(set(list_not_empty_rows) - set(list_empty_rows))
-    list_to_insert.sort()
-    counter = 0
-    for c, i in enumerate(list_to_insert):
-        counter = counter + 1
-        dfs = np.split(data_df, [i + counter])
-        # creating the empty data with index
-        empty_row = pd.DataFrame([], index=[i])
-        data_df = pd.concat([dfs[0],
-                             pd.DataFrame(empty_row,
-                                          columns=data_df.columns), dfs[1]],
-                            ignore_index=True)
-        del dfs
-
-    data_df = data_df.reset_index(drop=True)  # reset the index
-
-    # add headers to data_df dataframe
-    data_df.columns = short_df.iloc[header_raw]
+def stream_dataframe_processing(source_file, result_file, chunk_rows,
+                                source_name=None):
+    """
+    Process xlsx report by chunks of rows with bounded memory.
+    Sheets with report header are processed one after another.
+    :param source_file: path or file-like object of xlsx report
+    :param result_file: path of result file
+    :param chunk_rows: number of source rows in chunk
+    :param source_name: name of report in consolidated store,
+    name of result file by default
+    :return:
+    """
+    import openpyxl
+
+    logger.info(f'Streaming processing of {result_file} '
+                f'by {chunk_rows} rows')
 
+    source_name = source_name or os.path.basename(result_file)
+    wb = openpyxl.load_workbook(source_file, read_only=True, data_only=True)
+    spill_dir = tempfile.mkdtemp(prefix='stream_', dir=work_tmp_folder)
+    layouts = get_layout_cache()
+    parsed = open_parsed_report(source_name)
+    try:
+        worksheets = []
+        for worksheet in wb.worksheets:
+            head = list(islice(iter_sheet_rows(worksheet), HEAD_ROWS))
+            width = max((len(row) for row in head), default=0)
+            if has_report_header(rows_to_frame(head, width)):
+                worksheets.append(worksheet)
+        if not worksheets:
+            worksheets = wb.worksheets[:1]
+
+        sheets = []
+        totals = {'source_rows': 0, 'source_columns': 0, 'records': 0}
+        for ind, worksheet in enumerate(worksheets):
+            sheet_dir = os.path.join(spill_dir, str(ind))
+            os.mkdir(sheet_dir)
+            try:
+                chunks, sheet_totals = stream_sheet(
+                    worksheet, chunk_rows, sheet_dir, layouts,
+                    None if parsed is None
+                    else parsed.sheet_writer(ind, worksheet.title, True))
+            except Exception as e:
+                if len(worksheets) == 1:
+                    raise
+                logger.warning(f'Sheet {worksheet.title} is skipped. '
+                               f'Error is {e}')
+                if parsed is not None:
+                    parsed.remove_sheet(ind)
+                sheets.append((worksheet.title, e))
+                continue
+            # text columns are divided while chunks are written
+            sheets.append((worksheet.title,
+                           lambda chunks=chunks: iter_result_chunks(*chunks)))
+            totals = {key: max(value, sheet_totals[key])
+                      if key == 'source_columns'
+                      else value + sheet_totals[key]
+                      for key, value in totals.items()}
+        sheets = converted_sheets(sheets)
+        set_metrics(sheets=len(sheets), **totals)
+
+        with measure_stage('write'):
+            write_report_sheets(result_file, sheets)
+        if parsed is not None:
+            parsed.commit()
+        store_report(source_name, sheets)
+    finally:
+        wb.close()
+        if parsed is not None:
+            parsed.discard()
+        shutil.rmtree(spill_dir, ignore_errors=True)
+
+
+def stream_sheet(worksheet, chunk_rows, spill_dir, layouts=None,
+                 keep_parsed=None):
+    """
+    Process report sheet by chunks of rows.
+    Header and column roles are detected on the first rows,
+    processed chunks are kept in spill folder until all columns
+    are known.
+    :param worksheet: read-only openpyxl worksheet
+    :param chunk_rows: number of source rows in chunk
+    :param spill_dir: folder for processed chunks
+    :param layouts: LayoutCache or None
+    :param keep_parsed: function saving records of chunk before
+    categorization or None
+    :return: tuple (arguments of iter_result_chunks, dict of sheet sizes)
+    """
+    rows = measure_iteration(iter_sheet_rows(worksheet), 'read')
+    head = list(islice(rows, HEAD_ROWS))
+    width = max((len(row) for row in head), default=0)
+
+    short_df = rows_to_frame(head, width)
+    with measure_stage('header'):
+        layout_key, layout = (None, None) if layouts is None \
+            else layouts.find(short_df)
+        if layout is not None:
+            header_raw, my_tb_start = layout_start(layout)
+        else:
+            header_raw, my_tb_start = find_table_start(short_df)
+    logger.debug(f"header_raw: {header_raw}")
+    logger.debug(f"my_tb_start: {my_tb_start}")
+    header = short_df.iloc[header_raw].tolist()
+    date_column = my_tb_start[1]
     del short_df
 
-    COLUMNS_TO_DELETE = config['COLUMNS_TO_DELETE']
+    spill = ChunkSpill(spill_dir)
+    column_roles = None
+    source_rows = len(head)
+    records = 0
+
+    def process_chunk(chunk):
+        nonlocal column_roles, records
+
+        data_df = rows_to_frame(chunk, width)
+        with measure_stage('pairing'):
+            data_df_even, data_df_odd = split_records(
+                data_df, header + [np.nan] * (width - len(header)),
+                date_column)
+        del data_df
+        records += data_df_even.shape[0]
+
+        if column_roles is None:
+            with measure_stage('classification'):
+                if layout is not None and layout_matches(
+                        data_df_even, data_df_odd, layout_roles(layout)):
+                    column_roles = layout_roles(layout)
+                    set_metrics(layout='cached')
+                else:
+                    column_roles = detect_column_roles(data_df_even,
+                                                       data_df_odd)
+                    if layout_key is not None:
+                        layouts.put(layout_key, header_raw, my_tb_start,
+                                    column_roles)
+                    set_metrics(layout='detected')
+
+        with measure_stage('build'):
+            data_df_even = build_result_frame(data_df_even, data_df_odd,
+                                              column_roles)
+        if keep_parsed is not None:
+            with measure_stage('parsed'):
+                keep_parsed(data_df_even)
+
+        spill.add(data_df_even)
+        logger.debug(f'Chunk {len(spill.chunk_files)}: {len(chunk)} rows')
+
+    pending = head[my_tb_start[0]:]
+    for row in rows:
+        source_rows += 1
+        if len(row) > width:
+            if column_roles is None:
+                width = len(row)
+            else:
+                logger.warning(f'Row is wider than {width} columns, '
+                               f'extra cells are ignored')
+        pending.append(row)
+
+        # keep the tail for table end search
+        if len(pending) < chunk_rows + TABLE_END_ROWS:
+            continue
+
+        # cut chunk before the last record, it may continue in next rows
+        available = pending[:len(pending) - TABLE_END_ROWS]
+        record_rows = [ind for ind, pending_row in enumerate(available)
+                       if ind > 0 and not is_empty_cell(
+                           pending_row, date_column)]
+        if not record_rows:
+            continue
+        process_chunk(pending[:record_rows[-1]])
+        pending = pending[record_rows[-1]:]
+
+    while pending and not any(pd.notna(value) for value in pending[-1]):
+        pending.pop()
+
+    tail_df = rows_to_frame(pending, width)
+    with measure_stage('header'):
+        my_tb_end = find_table_end(tail_df[date_column])
+    del tail_df
+    process_chunk(pending[:my_tb_end])
+    del pending
+
+    return spill.chunks(), \
+        {'source_rows': source_rows, 'source_columns': width,
+         'records': records}
+
+
+class ChunkSpill:
+    """
+    Categorized chunks of streamed sheet, they are kept in spill folder
+    until all columns are known
+    """
 
-    data_df.drop(COLUMNS_TO_DELETE, axis=1, inplace=True, errors='ignore')
-    data_df.dropna(axis=1, how='all')
+    def __init__(self, spill_dir, config=config, rules=None):
+        self.spill_dir = spill_dir
+        self.config = config
+        self.rules = rules
+        self.chunk_files = []
+        self.not_empty = None
+        self.text_parts = {}
+
+    def add(self, data_df_even):
+        """
+        Add operations to records of chunk and save it to spill folder
+        :param data_df_even: result dataframe of chunk without
+        operation column
+        :return:
+        """
+        chunk_not_empty = data_df_even.notna().any().to_numpy()
+        self.not_empty = chunk_not_empty if self.not_empty is None \
+            else self.not_empty | chunk_not_empty
+
+        with measure_stage('categories'):
+            data_df_even = categorize_records(data_df_even, self.config,
+                                              self.rules)
+        if self.config.get('COMPACT_DTYPES'):
+            with measure_stage('compact'):
+                data_df_even = compact_dtypes(data_df_even, self.config)
+        with measure_stage('split'):
+            for ind, count in count_text_parts(
+                    data_df_even, range(data_df_even.shape[1]),
+                    self.config).items():
+                self.text_parts[ind] = max(self.text_parts.get(ind, 1),
+                                           count)
+
+        chunk_file = os.path.join(self.spill_dir,
+                                  f'{len(self.chunk_files)}.pkl')
+        data_df_even.to_pickle(chunk_file)
+        self.chunk_files.append(chunk_file)
+
+    def chunks(self):
+        """
+        Arguments of iter_result_chunks
+        """
+        return self.chunk_files, self.not_empty, self.text_parts
+
+
+def iter_sheet_rows(worksheet):
+    """
+    Read rows of xlsx sheet one by one
+    :param worksheet: read-only openpyxl worksheet
+    :return: generator of lists of cell values without trailing empty cells
+    """
+    for row in worksheet.iter_rows(values_only=True):
+        values = [convert_cell(value) for value in row]
+        while values and pd.isna(values[-1]):
+            values.pop()
+        yield values
 
-    data_df_even = data_df.iloc[::2]  # copy all even elements to new dataframe
-    data_df_odd = data_df.iloc[1::2]  # copy all odd elements to new dataframe
-    data_df_odd = data_df_odd.reset_index(drop=True)
-    data_df_even = data_df_even.reset_index(drop=True)
 
-    # convert empty to nan
-    data_df_odd_ = data_df_odd.replace(r'^\s*$', np.NaN, regex=True)
-    num_columns_list = []
-    cur_columns_list = []
+def convert_cell(value):
+    """
+    Convert cell value the same way as pandas.read_excel does
+    :param value: openpyxl cell value
+    :return: cell value
+    """
+    if value is None or value == '':
+        return np.nan
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
 
-    df_filter = pd.DataFrame()
 
-    for ind, column in enumerate(data_df_odd_.columns):
-        try:
-            df_filter = data_df_odd_.iloc[:-1, ind].dropna(how='all')
-            data_df_odd_.iloc[:, ind] = data_df_odd_.iloc[:, ind].apply(
-                pd.to_numeric)
+def is_empty_cell(row, column):
+    """
+    Check cell of row read by iter_sheet_rows
+    """
+    return column >= len(row) or pd.isna(row[column])
 
-            if len(df_filter.index) != 0:
-                num_columns_list.append(ind)
-        except Exception:
-            if len(df_filter.index) != 0 and \
-                    config['COLUMNS_NOT_CURRENCY'][
-                        0] not in df_filter.values and \
-                    config['COLUMNS_NOT_CURRENCY'][1] not in df_filter.values:
-                cur_columns_list.append(ind)
 
-    del data_df_odd_
+def rows_to_frame(rows, width):
+    """
+    Create dataframe of rows with the same number of columns
+    :param rows: lists of cell values
+    :param width: number of columns
+    :return: dataframe
+    """
+    return pd.DataFrame([row[:width] + [np.nan] * (width - len(row))
+                         for row in rows],
+                        columns=range(width))
 
-    int_columns_list = []
-    data_df_even_ = data_df_even.replace(r'^\s*$', np.NaN, regex=True)
 
-    for ind, column in enumerate(data_df_even_.columns):
-        try:
-            df_filter = data_df_even_.iloc[:-1, ind].dropna(how='all')
-            df_filter_int = df_filter.astype(int)
+def iter_result_chunks(chunk_files, not_empty, text_parts):
+    """
+    Read processed chunks and make final columns of them
+    :param chunk_files: pickled chunks of result dataframe
+    :param not_empty: bool array, columns with values in any chunk
+    :param text_parts: dict {column position: max number of lines}
+    :return: generator of result dataframes
+    """
+    # operation column is added after empty columns check
+    keep = np.append(not_empty, True)
+    keep_positions = np.flatnonzero(keep)
+    parts = None
 
-            if len(df_filter.index) != 0 and \
-                    (df_filter.apply(pd.to_numeric) % 1 == 0).all():
-                int_columns_list.append(ind)
-        except Exception:
-            pass
+    for chunk_file in chunk_files:
+        data_df = pd.read_pickle(chunk_file).iloc[:, keep_positions]
 
-        if len(int_columns_list) == 2:
-            break
+        if parts is None:
+            # text columns are found by the first rows as for whole file
+            parts = {ind: text_parts.get(keep_positions[ind], 1)
+                     for ind in text_split_candidates(data_df)}
+
+        yield split_text_columns(data_df, parts)
+
+
+def split_records(data_df, header, date_column, config=config):
+    """
+    Set report header to table rows and pair rows of records
+    :param data_df: table rows of report
+    :param header: header row of report
+    :param date_column: label of date column in data_df
+    :param config: settings, config.yaml by default
+    :return: tuple of dataframes (record rows, continuation rows)
+    """
+    # rows with date start a record
+    has_date = data_df[date_column].notna().to_numpy()
+
+    # columns are dropped while records are paired,
+    # so table rows are not copied before
+    COLUMNS_TO_DELETE = config['COLUMNS_TO_DELETE']
+    keep = np.flatnonzero(~pd.Index(header).isin(COLUMNS_TO_DELETE))
+
+    logger.debug('Pair record rows')
+    data_df_even, data_df_odd = pair_records(data_df, has_date,
+                                             data_df.columns[keep])
+
+    # add headers to record dataframes
+    titles = [header[ind] for ind in keep]
+    data_df_even.columns = titles
+    data_df_odd.columns = titles
+    return data_df_even, data_df_odd
+
+
+def detect_column_roles(data_df_even, data_df_odd, config=config):
+    """
+    Find numeric and currency columns in continuation rows
+    and debet/credit account columns in record rows.
+    Cells are checked by whole frames, not column by column.
+    The last row is not used to find values of column.
+    :param data_df_even: record rows
+    :param data_df_odd: continuation rows
+    :param config: settings, config.yaml by default
+    :return: tuple of column positions lists
+    (num_columns_list, cur_columns_list, int_columns_list)
+    """
+    # every value of column is a number, the last row too
+    numeric, odd_filled = all_cells_match(data_df_odd, 'number',
+                                          len(data_df_odd) - 1)
+    not_currency = data_df_odd.iloc[:-1].isin(
+        config['COLUMNS_NOT_CURRENCY'][:2]).to_numpy().any(axis=0)
+
+    num_columns = numeric & odd_filled
+    cur_columns = ~numeric & odd_filled & ~not_currency
 
-    del data_df_even_
+    int_columns, even_filled = all_cells_match(data_df_even.iloc[:-1],
+                                               'integer')
+    int_columns &= even_filled
 
-    int_columns_list.sort()
+    num_columns_list = np.flatnonzero(num_columns).tolist()
+    cur_columns_list = np.flatnonzero(cur_columns).tolist()
+    int_columns_list = np.flatnonzero(int_columns)[:2].tolist()
 
     if len(int_columns_list) < 2:
         logger.error('Cannot find orders columns')
 
+    logger.debug(f'num_columns_list={num_columns_list}')
+    logger.debug(f'cur_columns_list={cur_columns_list}')
+    logger.debug(f'int_columns_list={int_columns_list}')
+
+    return num_columns_list, cur_columns_list, int_columns_list
+
+
+def layout_matches(data_df_even, data_df_odd, column_roles, config=config):
+    """
+    Check that detect_column_roles finds the same roles in records.
+    Columns of roles are checked in full, other columns are checked
+    only to have no values of any role, so check is cheaper than detection.
+    :param data_df_even: record rows
+    :param data_df_odd: continuation rows
+    :param column_roles: roles of cached layout
+    :param config: settings, config.yaml by default
+    :return: True if roles are the same
+    """
+    num_columns_list, cur_columns_list, int_columns_list = column_roles
+    role_columns = num_columns_list + cur_columns_list
+    if len(int_columns_list) < 2 or \
+            max(role_columns + int_columns_list) >= data_df_odd.shape[1]:
+        return False
+
+    not_currency = data_df_odd.iloc[:-1].isin(
+        config['COLUMNS_NOT_CURRENCY'][:2]).to_numpy().any(axis=0)
+    # column without role is empty or has not currency values,
+    # so only columns of other values are checked
+    no_role = np.ones(data_df_odd.shape[1], dtype=bool)
+    no_role[role_columns] = False
+    checked = role_columns + np.flatnonzero(no_role & ~not_currency).tolist()
+    numeric, odd_filled = all_cells_match(data_df_odd.iloc[:, checked],
+                                          'number', len(data_df_odd) - 1)
+    roles_count = len(role_columns)
+    if odd_filled[roles_count:].any() or \
+            not odd_filled[:roles_count].all() or \
+            not numeric[:len(num_columns_list)].all() or \
+            numeric[len(num_columns_list):roles_count].any() or \
+            not_currency[cur_columns_list].any():
+        return False
+
+    # debet and credit are the first two integer columns
+    int_columns, even_filled = all_cells_match(
+        data_df_even.iloc[:-1, :int_columns_list[1] + 1], 'integer')
+    int_columns &= even_filled
+    return np.flatnonzero(int_columns)[:2].tolist() == int_columns_list
+
+
+def all_cells_match(data_df, kind, filled_rows=None):
+    """
+    Find columns where every cell is empty or a number of given kind,
+    and columns with any not blank cell, by the same coerced cells.
+    Columns are checked on the first ROLE_SAMPLE_ROWS rows, only columns
+    passed the sample are checked in full.
+    :param data_df: dataframe
+    :param kind: 'number' or 'integer', see coerce_cells
+    :param filled_rows: number of the first rows to find filled columns,
+    all rows by default
+    :return: tuple of bool arrays by columns (matching, filled)
+    """
+    result = np.zeros(data_df.shape[1], dtype=bool)
+
+    sample = coerce_cells(data_df.iloc[:ROLE_SAMPLE_ROWS])
+    candidates = np.flatnonzero((sample['blank'] | sample[kind]).all(axis=0))
+    if len(data_df) <= ROLE_SAMPLE_ROWS:
+        result[candidates] = True
+        return result, (~sample['blank'][:filled_rows]).any(axis=0)
+
+    # column with a cell of other kind in sample is filled
+    filled = np.ones(data_df.shape[1], dtype=bool)
+    if len(candidates) > 0:
+        full = coerce_cells(data_df.iloc[:, candidates])
+        result[candidates] = (full['blank'] | full[kind]).all(axis=0)
+        filled[candidates] = (~full['blank'][:filled_rows]).any(axis=0)
+    return result, filled
+
+
+def is_blank_value(value):
+    """
+    Check cell value for empty, nan or string of spaces
+    """
+    if isinstance(value, str):
+        return not value or value.isspace()
+    # nan and NaT are not equal to themselves
+    return value is None or value != value
+
+
+blank_values = np.frompyfunc(is_blank_value, 1, 1)
+
+
+def coerce_cells(data_df):
+    """
+    Convert all cells of dataframe to numbers with one call
+    :param data_df: dataframe
+    :return: dict of bool 2d arrays of dataframe shape:
+    'blank' - cell is empty or spaces, 'number' - cell is a number
+    or a string of number, 'integer' - cell is an integer number
+    or a string of integer
+    """
+    shape = data_df.shape
+    cells = data_df.to_numpy(dtype=object).reshape(-1)
+    blank = blank_values(cells).astype(bool)
+
+    # datetime and other objects are not numbers,
+    # empty strings and spaces are coerced to nan
+    values = pd.to_numeric(pd.Series(cells, dtype=object), errors='coerce') \
+        .to_numpy(dtype=float, na_value=np.nan)
+    number = ~np.isnan(values)
+
+    is_text = np.fromiter((type(value) is str for value in cells),
+                          dtype=bool, count=len(cells))
+    integer = number & np.isfinite(values) & (np.mod(values, 1) == 0)
+    integer[is_text] = pd.Series(cells[is_text], dtype=object).str.fullmatch(
+        r'\s*[+-]?\d+\s*').to_numpy(dtype=bool)
+
+    return {'blank': blank.reshape(shape),
+            'number': number.reshape(shape),
+            'integer': integer.reshape(shape)}
+
+
+def build_result_frame(data_df_even, data_df_odd, column_roles,
+                       config=config):
+    """
+    Create result dataframe on the base of record rows
+    and values of continuation rows
+    :param data_df_even: record rows
+    :param data_df_odd: continuation rows
+    :param column_roles: result of detect_column_roles
+    :param config: settings, config.yaml by default
+    :return: result dataframe
+    """
+    num_columns_list, cur_columns_list, int_columns_list = column_roles
     debet_column = int_columns_list[0]
     credit_column = int_columns_list[1]
 
-    '''Create result dataframe on the base of even data'''
+    # list of (column name, column values) of result dataframe
+    result_columns = [(column, data_df_even.iloc[:, ind])
+                      for ind, column in enumerate(data_df_even.columns)]
     credit_shift = 0
 
     if len(cur_columns_list) > 0:
-        data_df_even.insert(debet_column + 2,
-                            config['COLUMN_NAMES']['currency_deb'],
-                            # "Валюта дебет",
-                            data_df_odd.iloc[:, cur_columns_list[0]],
-                            True)
+        result_columns.insert(debet_column + 2,
+                              (config['COLUMN_NAMES']['currency_deb'],
+                               # "Валюта дебет",
+                               data_df_odd.iloc[:, cur_columns_list[0]]))
         credit_shift = credit_shift + 1
 
-        data_df_even.insert(debet_column + 2 + credit_shift,
-                            # "Сума у вал. дебет",
-                            config['COLUMN_NAMES']['sum_currency_deb'],
-                            data_df_odd.iloc[:, num_columns_list[0]],
-                            True)
+        result_columns.insert(debet_column + 2 + credit_shift,
+                              # "Сума у вал. дебет",
+                              (config['COLUMN_NAMES']['sum_currency_deb'],
+                               data_df_odd.iloc[:, num_columns_list[0]]))
 
         credit_shift = credit_shift + 1
 
-        data_df_even.insert(credit_column + 2 + credit_shift,
-                            # "Валюта кредит",
-                            config['COLUMN_NAMES']['currency_credit'],
-                            data_df_odd.iloc[:, cur_columns_list[1] if len(cur_columns_list) > 1 else cur_columns_list[0]],
-                            True)
+        result_columns.insert(credit_column + 2 + credit_shift,
+                              # "Валюта кредит",
+                              (config['COLUMN_NAMES']['currency_credit'],
+                               data_df_odd.iloc[:, cur_columns_list[1] if len(cur_columns_list) > 1 else cur_columns_list[0]]))
 
         credit_shift = credit_shift + 1
 
-        data_df_even.insert(credit_column + 2 + credit_shift,
-                            # "Сума у вал. кредит",
-                            config['COLUMN_NAMES']['sum_currency_credit'],
-                            data_df_odd.iloc[:, num_columns_list[1]],
-                            True)
+        result_columns.insert(credit_column + 2 + credit_shift,
+                              # "Сума у вал. кредит",
+                              (config['COLUMN_NAMES']['sum_currency_credit'],
+                               data_df_odd.iloc[:, num_columns_list[1]]))
     elif len(num_columns_list) > 0:
-        data_df_even.insert(debet_column + 2,
-                            config['COLUMN_NAMES']['count'],
-                            data_df_odd.iloc[:, num_columns_list[0]],
-                            True)
+        result_columns.insert(debet_column + 2,
+                              (config['COLUMN_NAMES']['count'],
+                               data_df_odd.iloc[:, num_columns_list[0]]))
         credit_shift = credit_shift + 1
 
         if len(num_columns_list) > 1:
-            data_df_even.insert(credit_column + 2 + credit_shift,
-                                # "Сума у вал. кредит",
-                                config['COLUMN_NAMES']['count'],
-                                data_df_odd.iloc[:, num_columns_list[1]],
-                                True)
+            result_columns.insert(credit_column + 2 + credit_shift,
+                                  # "Сума у вал. кредит",
+                                  (config['COLUMN_NAMES']['count'],
+                                   data_df_odd.iloc[:, num_columns_list[1]]))
 
     # 'Сума в грн дебет'
-    data_df_even.columns.values[debet_column + 1] = config['COLUMN_NAMES'][
-        'sum_hrn_deb']
+    result_columns[debet_column + 1] = (
+        config['COLUMN_NAMES']['sum_hrn_deb'],
+        result_columns[debet_column + 1][1])
     # 'Сума в грн кредит'
-    data_df_even.columns.values[credit_column + 1 + credit_shift] = config['COLUMN_NAMES']['sum_hrn_credit']
+    result_columns[credit_column + 1 + credit_shift] = (
+        config['COLUMN_NAMES']['sum_hrn_credit'],
+        result_columns[credit_column + 1 + credit_shift][1])
 
-    data_df_even.insert(data_df_even.shape[1],
-                        config['COLUMN_NAMES']['saldo_currency'],
-                        # "Сальдо у валюті",
-                        data_df_odd.iloc[:, data_df_odd.shape[1] - 1], True)
+    # 'Сальдо в грн'
+    result_columns[-1] = (config['COLUMN_NAMES']['saldo_hrn'],
+                          result_columns[-1][1])
+    result_columns.append((config['COLUMN_NAMES']['saldo_currency'],
+                           # "Сальдо у валюті",
+                           data_df_odd.iloc[:, data_df_odd.shape[1] - 1]))
 
-    data_df_even.columns.values[data_df_even.shape[1] - 2] = config['COLUMN_NAMES']['saldo_hrn']  # 'Сальдо в грн'
+    result_columns.insert(0, ("N", pd.Series(1, index=data_df_even.index)))
 
-    data_df_even.insert(0, "N",
-                        pd.DataFrame(1, index=range(data_df_even.shape[0]),
-                                     columns=list('N'))['N'],
-                        True)
+    # build result dataframe with one concatenation
+    data_df_even = pd.concat([values for _, values in result_columns],
+                             axis=1, ignore_index=True)
+    data_df_even.columns = [column for column, _ in result_columns]
 
-    data_df_even.dropna(axis='columns', how='all', inplace=True)
-
-    logger.debug('data_df_even.head(10):')
-    logger.debug(tabulate(data_df_even.head(10), tablefmt='psql'))
-    logger.debug('data_df_even.columns:')
-    logger.debug(data_df_even.columns)
-    logger.debug('data_df_odd.head(10):')
-    logger.debug(tabulate(data_df_odd.head(10), tablefmt='psql'))
-    logger.debug('data_df_odd.dtypes:')
-    logger.debug(data_df_odd.dtypes)
-    logger.debug('data_df_odd.columns:')
-    logger.debug(data_df_odd.columns)
+    return data_df_even
 
-    logger.debug(f'num_columns_list={num_columns_list}')
-    logger.debug(f'cur_columns_list={cur_columns_list}')
 
+def categorize_records(data_df_even, config=config, rules=None):
+    """
+    Add operation column by debet, credit and sign of sum
+    :param data_df_even: result dataframe
+    :param config: settings, config.yaml by default
+    :param rules: CategoryRules, categories.conf by default
+    :return: result dataframe with operation column
+    """
     debet = config['COLUMN_NAMES']['debet']
     credit = config['COLUMN_NAMES']['credit']
     operation = config['COLUMN_NAMES']['operation']
+    sum_hrn_deb = config['COLUMN_NAMES']['sum_hrn_deb']
+    sum_hrn_credit = config['COLUMN_NAMES']['sum_hrn_credit']
 
-
-    data_df_even.rename(
-        columns={config['COLUMN_NAMES']['sum_hrn_deb']: 'sum_hrn_deb',
-                 config['COLUMN_NAMES']['sum_hrn_credit']: 'sum_hrn_credit'},
-        inplace=True)
-    df_oper = pd.read_csv('categories.conf', sep=";", header=None,
-                          names=[debet, credit, "Sign", operation]
-                          )
-
-    data_df_even['Sign'] = '+'
-    #
     data_df_even[debet] = data_df_even[debet].astype(int)
     data_df_even[credit] = data_df_even[credit].astype(int)
 
-    data_df_even['sum_hrn_deb'] = pd.to_numeric(data_df_even['sum_hrn_deb'],
-                                                errors='coerce')
-    data_df_even['sum_hrn_credit'] = pd.to_numeric(
-        data_df_even['sum_hrn_credit'], errors='coerce')
-
-    data_df_even['Sign'] = data_df_even['Sign'].astype(str)
-    df_oper[debet] = df_oper[debet].astype(int)
-    df_oper[credit] = df_oper[credit].astype(int)
-    df_oper['Sign'] = df_oper['Sign'].astype(str)
+    data_df_even[sum_hrn_deb] = pd.to_numeric(data_df_even[sum_hrn_deb],
+                                              errors='coerce')
+    data_df_even[sum_hrn_credit] = pd.to_numeric(
+        data_df_even[sum_hrn_credit], errors='coerce')
 
-    data_df_even.loc[data_df_even.sum_hrn_deb < 0, "Sign"] = "-"
+    if rules is None:
+        rules = get_category_rules(config=config)
 
-    data_df_even = pd.merge(data_df_even,
-                            df_oper,
-                            how='left',
-                            left_on=[debet, credit, "Sign"],
-                            right_on=[debet, credit, "Sign"])
+    data_df_even[operation] = rules.classify(
+        data_df_even[debet].to_numpy(),
+        data_df_even[credit].to_numpy(),
+        (data_df_even[sum_hrn_deb] < 0).to_numpy())
 
-    data_df_even[operation] = np.where(
-        ((data_df_even[debet] == 632) & (data_df_even[operation].isna())) | (
-                (data_df_even[credit] == 632) &
-                (data_df_even[operation].isna())), config['CARD_NOT_EXISTS'],
-        data_df_even[operation])
+    return data_df_even
 
-    data_df_even.drop('Sign', axis=1, inplace=True, errors='ignore')
 
-    data_df_even.rename(
-        columns={'sum_hrn_deb': config['COLUMN_NAMES']['sum_hrn_deb'],
-                 'sum_hrn_credit': config['COLUMN_NAMES']['sum_hrn_credit']},
-        inplace=True)
-
-    # Divide strings in columns by \n character
+def compact_dtypes(data_df, config=config):
+    """
+    Memory-lean types of result columns: int32 accounts, categorical
+    currencies and operations, float64 amounts. Text amounts are
+    left as they are.
+    :param data_df: result dataframe with operation column
+    :param config: settings, config.yaml by default
+    :return: result dataframe
+    """
+    names = config['COLUMN_NAMES']
+    account_titles = {names['debet'], names['credit']}
+    category_titles = {names['currency_deb'], names['currency_credit'],
+                       names['operation']}
+    amount_titles = {names[key] for key in (
+        'sum_hrn_deb', 'sum_hrn_credit', 'sum_currency_deb',
+        'sum_currency_credit', 'saldo_hrn', 'saldo_currency', 'count')}
+
+    # columns are set by positions, titles may be repeated
+    for ind, title in enumerate(data_df.columns):
+        column = data_df.iloc[:, ind]
+        if title in account_titles:
+            # accounts are less than ACCOUNT_KEY_BASE
+            data_df.isetitem(ind, column.astype(np.int32))
+        elif title in category_titles:
+            data_df.isetitem(ind, column.astype('category'))
+        elif title in amount_titles and column.dtype != np.float64:
+            try:
+                data_df.isetitem(ind, pd.to_numeric(column)
+                                 .astype(np.float64))
+            except (ValueError, TypeError):
+                pass
 
-    for column in data_df_even:
-        try:
-            if data_df_even[column].dtypes == object and isinstance(data_df_even.iloc[1][column], str):
-                new_df = data_df_even[column].str.split('\n', expand=True)
-                if len(new_df.columns) > 1:
-                    ind = data_df_even.columns.get_loc(column)
-                    title = column
-                    data_df_even.drop(column, axis=1, inplace=True, errors='ignore')
-                    add_i = 0
-                    for col in new_df:
-                        data_df_even.insert(ind + add_i, title + '_' + str(add_i), new_df[col].values)
-                        add_i += 1
-        except ValueError:
-            pass
+    return data_df
 
-    rename_xlsx_file(result_file, data_df_even)
 
+class CategoryRules:
+    """
+    Operations by debet, credit and sign of sum from categories.conf.
+    Line of file is "debet;credit;sign;operation". Account may end
+    with * to match all accounts with this prefix, * alone matches
+    any account, sign * matches both signs. Exact rules win over
+    prefix rules, longer prefixes win over shorter.
+    """
 
-def xls_processing(xls_file):
-    base = os.path.splitext(os.path.basename(xlsx_file))[0]
-    logger.info(f'start with file {xls_file}')
-    dataframe_processing(os.path.join(SOURCE_FILES_FOLDER, xls_file),
-                         os.path.join(RESULT_FILES_FOLDER,
-                                      base + os.path.splitext(xls_file)[1]))
-    return True
+    def __init__(self, lines, fallback_accounts, fallback_operation):
+        # {(debet, credit, sign): operation}, accounts and signs are strings
+        self.rules = {}
+        for line_number, line in enumerate(lines, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            parts = [part.strip() for part in line.split(';', 3)]
+            if len(parts) != 4:
+                logger.warning(f'Wrong categories line {line_number}: '
+                               f'{line}')
+                continue
+            rule_key = tuple(parts[:3])
+            if rule_key in self.rules:
+                logger.warning(f'Duplicated categories rule '
+                               f'{";".join(rule_key)} in line '
+                               f'{line_number}, first one is used')
+                continue
+            self.rules[rule_key] = parts[3]
+
+        self.fallback_accounts = {str(account)
+                                  for account in fallback_accounts}
+        self.fallback_operation = fallback_operation
+        # resolved operations by packed key
+        self.operations = {}
+
+    @staticmethod
+    def pack_keys(debet, credit, negative):
+        """
+        Pack debet, credit and sign arrays to one int64 key array
+        """
+        return (debet.astype(np.int64) * ACCOUNT_KEY_BASE
+                + credit.astype(np.int64)) * 2 + negative.astype(np.int64)
+
+    def classify(self, debet, credit, negative):
+        """
+        Find operations for arrays of debet, credit and sign
+        :param debet: int array of debet accounts
+        :param credit: int array of credit accounts
+        :param negative: bool array, True for negative sum
+        :return: object array of operations, nan if not found
+        """
+        keys, inverse = np.unique(self.pack_keys(debet, credit, negative),
+                                  return_inverse=True)
+        operations = np.array([self.lookup(key) for key in keys.tolist()],
+                              dtype=object)
+        return operations[inverse.reshape(-1)]
+
+    def lookup(self, key):
+        """
+        Find operation for packed key
+        :param key: int, result of pack_keys
+        :return: operation or nan
+        """
+        if key in self.operations:
+            return self.operations[key]
+
+        sign = '-' if key % 2 else '+'
+        debet, credit = divmod(key // 2, ACCOUNT_KEY_BASE)
+        debet, credit = str(debet), str(credit)
+
+        operation = np.nan
+        for rule_key in product(self.account_patterns(debet),
+                                self.account_patterns(credit),
+                                (sign, '*')):
+            if rule_key in self.rules:
+                operation = self.rules[rule_key]
+                break
+        else:
+            if debet in self.fallback_accounts or \
+                    credit in self.fallback_accounts:
+                operation = self.fallback_operation
 
+        self.operations[key] = operation
+        return operation
 
-def read_file_to_dataframe(filename):
+    @staticmethod
+    def account_patterns(account):
+        """
+        Account patterns from the most to the least specific
+        """
+        return [account] + [account[:i] + '*'
+                            for i in range(len(account), 0, -1)] + ['*']
 
-    ext = os.path.splitext(os.path.basename(filename))[1]
 
-    logger.info('Reading dataframe. It takes a time. Please wait.')
+class LayoutCache:
+    """
+    Layouts of report templates by fingerprint of header row, that is
+    titles of columns with their positions. Layout keeps header row,
+    date column, the first table row and column roles. File is read
+    once per process and written when new layout is found, layouts
+    written by other processes are kept.
+    """
 
-    df = pd.DataFrame()
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.layouts = self.read()
 
-    if ext == '.xlsb':
-        df = pd.read_excel(filename, engine='pyxlsb')
-    else:
-        first_type_successful = 0
+    def read(self):
+        """
+        Read layouts file
+        :return: dict {fingerprint: layout}, empty if file is not found
+        """
         try:
-            # works with strange old format of excel
-            wb = xlrd.open_workbook(filename, encoding_override='cp1251')
-            df = pd.read_excel(wb)
-            first_type_successful = 1
-        except xlrd.XLRDError:
-            pass
-        except Exception as e:
-            logger.error(f'Exception type is: {e.__class__.__name__}. '
+            with open(self.path, 'rt', encoding='utf8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.error(f'Cannot read layouts file {self.path}. '
                          f'Error is {e}')
-
-        if first_type_successful == 0:
+            return {}
+
+    @staticmethod
+    def fingerprint(header):
+        """
+        Hash of titles of header row with their positions
+        """
+        titles = [None if pd.isna(title) else str(title) for title in header]
+        return hashlib.sha256(json.dumps(titles, ensure_ascii=False)
+                              .encode()).hexdigest()
+
+    def find(self, short_df, config=config):
+        """
+        Find layout of report by its header row. Layout is used
+        if its first table row is the first date after header.
+        :param short_df: first rows of report
+        :param config: settings, config.yaml by default
+        :return: tuple (fingerprint or None if there is no header,
+        layout or None)
+        """
+        header_raw = find_header_row(short_df, config)
+        if header_raw is None:
+            return None, None
+
+        key = self.fingerprint(short_df.iloc[header_raw].tolist())
+        layout = self.layouts.get(key)
+        if layout is None or layout['header_row'] != header_raw or \
+                layout['date_column'] >= short_df.shape[1] or \
+                not header_raw < layout['table_start'] < short_df.shape[0]:
+            return key, None
+
+        dates = dates_mask(short_df.iloc[header_raw + 1:
+                                         layout['table_start'] + 1,
+                                         layout['date_column']]).to_numpy()
+        if not dates[-1] or dates[:-1].any():
+            return key, None
+
+        logger.debug(f'Layout {key[:12]} is found')
+        return key, layout
+
+    def put(self, key, header_raw, table_start, column_roles):
+        """
+        Add layout and write layouts file
+        :param key: fingerprint of header row
+        :param header_raw: header row index
+        :param table_start: [row index, column] of the first date
+        :param column_roles: result of detect_column_roles
+        :return:
+        """
+        num_columns_list, cur_columns_list, int_columns_list = column_roles
+        # not usable layouts are not kept, detection is repeated
+        if len(int_columns_list) < 2 or table_start[0] <= header_raw:
+            return
+
+        layout = {'header_row': int(header_raw),
+                  'table_start': int(table_start[0]),
+                  'date_column': int(table_start[1]),
+                  'num_columns': num_columns_list,
+                  'cur_columns': cur_columns_list,
+                  'int_columns': int_columns_list}
+        with self.lock:
+            if self.layouts.get(key) == layout:
+                return
+            self.layouts = dict(self.read(), **{key: layout})
+            logger.info(f'New layout {key[:12]} is saved')
+
+            folder = os.path.dirname(self.path)
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+            # other processes read complete file only
+            tmp_file = f'{self.path}.{os.getpid()}.tmp'
             try:
-                df = pd.read_excel(filename, header=None)
-            except Exception as e:
-                logger.error(f'Exception type is: {e.__class__.__name__}. '
+                with open(tmp_file, 'wt', encoding='utf8') as f:
+                    json.dump(self.layouts, f, ensure_ascii=False, indent=1)
+                os.replace(tmp_file, self.path)
+            except OSError as e:
+                logger.error(f'Cannot write layouts file {self.path}. '
                              f'Error is {e}')
 
-    return df
-
 
-def rename_xlsx_file(file_name, df):
-    data_df_even = df
-    try:
-        data_df_even.to_excel(file_name, index=False, header=True)
-        logger.info(f'Done with {file_name}')
-    except Exception as e:
-        logger.error(e)
-        time.sleep(0.1)
-        if input(f'Please, close file {file_name}\nAnd try again. Please, '
-                 f'type [Y] for retry or any other for cancel:') == 'Y':
-            rename_xlsx_file(file_name, data_df_even)
-        else:
-            logger.error(f'Break with {file_name}')
+def layout_start(layout):
+    """
+    Header row and the first date cell of layout
+    :return: tuple as of find_table_start
+    """
+    return layout['header_row'], [layout['table_start'],
+                                  layout['date_column']]
 
 
-def is_date(string, fuzzy=False):
+def layout_roles(layout):
     """
-    Return whether the string can be interpreted as a date.
-
-    :param string: str, string to check for date
-    :param fuzzy: bool, ignore unknown tokens in string if True
+    Column roles of layout
+    :return: tuple as of detect_column_roles
     """
-    try:
-        parse(string, fuzzy=fuzzy)
-        return True
+    return layout['num_columns'], layout['cur_columns'], layout['int_columns']
 
-    except ValueError:
-        return False
 
+# layout caches by file
+layout_caches = {}
 
-def delete_tmp_folder(tmp_dir):
+
+def get_layout_cache(config=config):
     """
-    Clean folder recursively
-    :param tmp_dir:
-    :return:
+    Layout cache of LAYOUT_CACHE_FILE, read once per process
+    :param config: settings, config.yaml by default
+    :return: LayoutCache or None if it is not configured
     """
-    logger.debug(f'Cleaning of tmp dir {tmp_dir}')
+    if not config.get('LAYOUT_CACHE_FILE'):
+        return None
+    path = config_path(config['LAYOUT_CACHE_FILE'])
+    if path not in layout_caches:
+        layout_caches[path] = LayoutCache(path)
+    return layout_caches[path]
 
-    for filename in os.listdir(tmp_dir):
-        file_path = os.path.join(tmp_dir, filename)
-        try:
-            if os.path.isfile(file_path) or os.path.islink(file_path):
-                os.unlink(file_path)
-            elif os.path.isdir(file_path):
-                shutil.rmtree(file_path)
-        except Exception as e:
-            logger.error('Failed to delete %s. Reason: %s' % (file_path, e))
 
+# compiled rules and modification time of categories file
+# by file and fallback settings
+category_rules_cache = {}
 
-def remove_source_file(file_to_remove):
-    if config['MOVE_SOURCE'] is True:
-        logger.info(
-            f'Move {os.path.join(SOURCE_FILES_FOLDER, file_to_remove)} '
-            f'to {os.path.join(CONVERTED_FILES_FOLDER, file_to_remove)}')
 
-        shutil.move(os.path.join(SOURCE_FILES_FOLDER, file_to_remove),
-                    os.path.join(CONVERTED_FILES_FOLDER, file_to_remove))
+def compile_categories(lines, config=config):
+    """
+    Compile lines of categories file with fallback of config
+    :param lines: iterable of "debet;credit;sign;operation" lines
+    :param config: settings, config.yaml by default
+    :return: CategoryRules
+    """
+    return CategoryRules(lines,
+                         config.get('CARD_NOT_EXISTS_ACCOUNTS', [632]),
+                         config['CARD_NOT_EXISTS'])
 
 
-if __name__ == '__main__':
-    args = parse_args()
+def get_category_rules(path=CATEGORIES_FILE, config=config):
+    """
+    Compile categories file once, compile again if file is changed
+    :param path: categories file
+    :param config: settings, config.yaml by default
+    :return: CategoryRules
+    """
+    mtime = os.stat(path).st_mtime_ns
+    cache_key = (path, config['CARD_NOT_EXISTS'],
+                 tuple(config.get('CARD_NOT_EXISTS_ACCOUNTS', [632])))
+    cached = category_rules_cache.get(cache_key)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
 
-    log_level = args.log_level
+    logger.debug(f'Compile categories from {path}')
+    with open(path, 'rt', encoding='utf8') as categories_file:
+        rules = compile_categories(categories_file, config)
+    category_rules_cache[cache_key] = (mtime, rules)
+    return rules
 
-    set_logger(logger, log_level)
 
-    for xlsx_file in os.listdir(SOURCE_FILES_FOLDER):
-        #try:
-        if xlsx_file.endswith(".xls"):
-            if xls_processing(xlsx_file):
-                remove_source_file(xlsx_file)
-        elif xlsx_file.endswith(".xlsx") or xlsx_file.endswith(".xlsb"):
-            if xlsx_processing(xlsx_file):
-                remove_source_file(xlsx_file)
-        #except Exception as ex:
-            #logger.error(ex)
+def text_split_candidates(data_df):
+    """
+    Find text columns to divide by \n character
+    :param data_df: result dataframe
+    :return: list of column positions
+    """
+    positions = []
+    if data_df.shape[0] < 2:
+        return positions
 
+    duplicated = data_df.columns.duplicated(keep=False)
+    for ind in range(data_df.shape[1]):
+        if not duplicated[ind] and data_df.iloc[:, ind].dtype == object and \
+                isinstance(data_df.iloc[1, ind], str):
+            positions.append(ind)
 
-    delete_tmp_folder(TMP_FOLDER)
+    return positions
 
-    logger.info('DONE!')
 
-    time.sleep(0.1)
-    print('\a')
-    input('Press ENTER to exit')
+def count_text_parts(data_df, positions, config=config):
+    """
+    Count max number of lines in text columns. Lines of all columns
+    are counted at once, number of parts is limited by TEXT_SPLIT_LIMITS.
+    :param data_df: result dataframe
+    :param positions: column positions to check
+    :param config: settings, config.yaml by default
+    :return: dict {column position: max number of lines}
+    """
+    limits = config.get('TEXT_SPLIT_LIMITS') or {}
+    parts = {}
+    counted = []
+    for ind in positions:
+        if data_df.iloc[:, ind].dtype != object:
+            continue
+        if limits.get(data_df.columns[ind], 0) == 1:
+            parts[ind] = 1
+        else:
+            counted.append(ind)
+
+    if not counted:
+        return parts
+
+    cells = data_df.iloc[:, counted].to_numpy(dtype=object)
+    lines = pd.Series(cells.reshape(-1), dtype=object).astype(str) \
+        .str.count('\n').to_numpy().reshape(cells.shape) \
+        .max(axis=0, initial=0) + 1
+
+    for ind, count in zip(counted, lines.tolist()):
+        limit = limits.get(data_df.columns[ind], 0)
+        parts[ind] = min(count, limit) if limit > 0 else count
+
+    return parts
+
+
+def split_text_columns(data_df, parts):
+    """
+    Divide strings in columns by \n character
+    :param data_df: result dataframe
+    :param parts: dict {column position: number of lines},
+    columns with more than one line are divided,
+    lines above the number are left in the last part
+    :return: dataframe with divided columns
+    """
+    if not any(count > 1 for count in parts.values()):
+        return data_df
+
+    columns = []
+    titles = []
+    for ind, title in enumerate(data_df.columns):
+        column = data_df.iloc[:, ind]
+        count = parts.get(ind, 1)
+        if count <= 1:
+            columns.append(column.reset_index(drop=True))
+            titles.append(title)
+            continue
+
+        column = column.reset_index(drop=True)
+        if column.dtype == object:
+            lines = column.where(column.map(type) == str) \
+                .str.split('\n', n=count - 1)
+        else:
+            lines = pd.Series(np.nan, index=column.index, dtype=object)
+        # parts are taken one by one, lists of lines are not expanded
+        # to a dataframe
+        for add_i in range(count):
+            columns.append(shared_strings(lines.str.get(add_i)))
+            titles.append(f'{title}_{add_i}')
+        del lines
+
+    data_df = pd.concat(columns, axis=1, ignore_index=True)
+    data_df.columns = titles
+    return data_df
+
+
+def shared_strings(column):
+    """
+    Replace equal strings of column with one string object. Parts
+    of divided texts repeat a lot, e.g. type of document.
+    :param column: object series
+    :return: object series
+    """
+    codes, uniques = pd.factorize(column)
+    if len(uniques) == len(column):
+        return column
+    # -1 of empty cell takes nan added to the end
+    return pd.Series(np.append(uniques.astype(object), np.nan)[codes],
+                     index=column.index, name=column.name, dtype=object)
+
+
+def find_table_start(short_df, config=config):
+    """
+    Find header row and first cell with date in the head of report
+    :param short_df: first rows of report
+    :param config: settings, config.yaml by default
+    :return: tuple (header row index, [row index, column] of first date)
+    """
+    header_raw = find_header_row(short_df, config)
+
+    date_column = -1
+    if header_raw is not None:
+        for ind, val in enumerate(short_df.iloc[header_raw]):
+            if val in config['DATE_COLUMN_IN']:
+                date_column = ind
+                break
+
+    if header_raw is None:
+        header_raw = 0
+
+    dates = short_df.apply(dates_mask).to_numpy()
+    # before header any cell with date starts the table,
+    # after header only cell in date column
+    if date_column != -1:
+        dates[header_raw:, :date_column] = False
+        dates[header_raw:, date_column + 1:] = False
+
+    # first date cell row by row
+    date_cells = np.argwhere(dates)
+    if len(date_cells) == 0:
+        raise ValueError('Cannot find the first row with date')
+    i, j = date_cells[0]
+
+    return header_raw, [i, short_df.columns[j]]
+
+
+def find_header_row(short_df, config=config):
+    """
+    Find the first row with HEADER_DETECTOR
+    :param short_df: first rows of report
+    :param config: settings, config.yaml by default
+    :return: row index or None
+    """
+    header_rows = np.flatnonzero(
+        short_df.astype(str).eq(config['HEADER_DETECTOR']).any(axis=1))
+    return int(header_rows[0]) if len(header_rows) > 0 else None
+
+
+def find_table_end(date_column):
+    """
+    Find the end of the table by the last date in the date column
+    :param date_column: date column of report
+    :return: index of the row after the table
+    """
+    col_one_list = date_column.tolist()[-10:]
+    dates = dates_mask(col_one_list).to_numpy()
+
+    # iterate over rows from the end
+    for i, elem_is_date in enumerate(dates[::-1]):
+        if elem_is_date:
+            if pd.isna(col_one_list[len(col_one_list) - i]):
+                return len(date_column) - i + 1
+            return len(date_column) - i
+
+    raise ValueError('Cannot find the last row with date')
+
+
+def pair_records(data_df, has_date, columns=None):
+    """
+    Pair every record row with its optional continuation row.
+    Record starts with a row with date, the next row without date
+    belongs to the same record.
+    :param data_df: table rows
+    :param has_date: bool array, True for rows with date
+    :param columns: labels of columns to take, all columns by default
+    :return: tuple of dataframes (record rows, continuation rows) of equal
+    length, continuation row is empty if record has no second line
+    """
+    record_rows = np.flatnonzero(has_date)
+    next_rows = record_rows + 1
+    has_next = next_rows < len(has_date)
+    has_next[has_next] = ~has_date[next_rows[has_next]]
+
+    # rows are labeled by positions without copy of table
+    data_df = data_df.copy(deep=False)
+    data_df.index = pd.RangeIndex(len(data_df))
+    if columns is None:
+        columns = data_df.columns
+
+    # rows and columns are taken with one copy
+    data_df_even = data_df.reindex(index=record_rows, columns=columns)
+    # -1 is out of index, so reindex gives empty row
+    data_df_odd = data_df.reindex(index=np.where(has_next, next_rows, -1),
+                                  columns=columns)
+    data_df_even.index = pd.RangeIndex(len(record_rows))
+    data_df_odd.index = pd.RangeIndex(len(record_rows))
+
+    return data_df_even, data_df_odd
+
+
+def xls_processing(xls_file, data=None):
+    base = os.path.splitext(os.path.basename(xls_file))[0]
+    logger.info(f'start with file {xls_file}')
+    dataframe_processing(os.path.join(SOURCE_FILES_FOLDER, xls_file)
+                         if data is None else io.BytesIO(data),
+                         os.path.join(RESULT_FILES_FOLDER,
+                                      base + os.path.splitext(xls_file)[1]),
+                         xls_file)
+    return True
+
+
+def read_file_to_dataframe(filename, ext=None, sheet_name=0):
+    """
+    Read report once by the engine of its format,
+    all cells are values, there is no header row
+    :param filename: path or seekable binary file-like object
+    :param ext: '.xls', '.xlsx' or '.xlsb', found by content if None
+    :param sheet_name: sheet name or position, None for all sheets
+    :return: dataframe or dict {sheet name: dataframe} for all sheets,
+    empty if file cannot be read
+    """
+    if ext is None:
+        ext = sniff_format(filename)
+
+    logger.info('Reading dataframe. It takes a time. Please wait.')
+
+    try:
+        if ext == '.xls':
+            import xlrd
+
+            # works with strange old format of excel
+            if hasattr(filename, 'read'):
+                wb = xlrd.open_workbook(file_contents=filename.read(),
+                                        encoding_override='cp1251')
+            else:
+                wb = xlrd.open_workbook(filename,
+                                        encoding_override='cp1251')
+            return pd.read_excel(wb, sheet_name=sheet_name, header=None)
+        if ext == '.xlsb':
+            return pd.read_excel(filename, sheet_name=sheet_name,
+                                 engine='pyxlsb', header=None)
+        if ext == '.xlsx':
+            return pd.read_excel(filename, sheet_name=sheet_name,
+                                 engine='openpyxl', header=None)
+        logger.error('File is not an excel workbook')
+    except Exception as e:
+        logger.error(f'Exception type is: {e.__class__.__name__}. '
+                     f'Error is {e}')
+
+    return {} if sheet_name is None else pd.DataFrame()
+
+
+def write_result_file(file_name, sheets):
+    """
+    Write result dataframes to file in OUTPUT_FORMAT from config.
+    Locked file is tried again WRITE_RETRIES times, other errors
+    are raised at once.
+    :param file_name: result file, extension is set by output format
+    :param sheets: function returning iterable of (sheet name, iterable
+    of result dataframes), dataframes of sheet are written one after
+    another, only xlsx may have several sheets
+    :return: name of written file
+    """
+    output_format = config.get('OUTPUT_FORMAT', 'xlsx')
+    file_name = os.path.splitext(file_name)[0] + '.' + output_format
+
+    if result_buffers is not None:
+        # pipeline mode, result is written to file by the parent process
+        buffer = io.BytesIO()
+        write_sheets(buffer, output_format, sheets())
+        result_buffers[file_name] = buffer.getvalue()
+        return file_name
+
+    return write_locked_file(
+        file_name,
+        lambda path: write_sheets(path, output_format, sheets()))
+
+
+def write_sheets(sink, output_format, sheets):
+    """
+    Write sheets of result dataframes
+    :param sink: result file or binary file-like object
+    :param output_format: xlsx, csv, parquet or feather
+    :param sheets: iterable of (sheet name, iterable of result dataframes)
+    :return:
+    """
+    with open_result_writer(sink, output_format) as writer:
+        for sheet_name, frames in sheets:
+            writer.add_sheet(sheet_name)
+            for data_df in frames:
+                writer.write(data_df)
+
+
+def write_locked_file(file_name, write):
+    """
+    Write file, locked file is tried again WRITE_RETRIES times,
+    other errors are raised at once and partly written file is removed
+    :param file_name: path of file
+    :param write: function writing file by its path
+    :return: name of written file
+    """
+    for attempt in range(1, WRITE_RETRIES + 1):
+        try:
+            write(file_name)
+            logger.info(f'Done with {file_name}')
+            return file_name
+        except PermissionError as e:
+            logger.error(f'Cannot write {file_name}, file is locked. '
+                         f'Attempt {attempt} of {WRITE_RETRIES}. Error is {e}')
+            if attempt < WRITE_RETRIES:
+                time.sleep(WRITE_RETRY_DELAY)
+        except Exception as e:
+            logger.error(f'Cannot write {file_name}. Error is {e}')
+            if os.path.exists(file_name):
+                os.remove(file_name)
+            raise
+
+    raise PermissionError(f'{file_name} is locked')
+
+
+def open_result_writer(file_name, output_format):
+    """
+    Create writer of result dataframes
+    :param file_name: result file or binary file-like object
+    :param output_format: xlsx, csv, parquet or feather
+    :return: ResultWriter
+    """
+    writers = {'xlsx': XlsxResultWriter,
+               'csv': CsvResultWriter,
+               'parquet': ParquetResultWriter,
+               'feather': FeatherResultWriter}
+    if output_format not in writers:
+        raise ValueError(f'Unknown output format {output_format}, '
+                         f'use one of {", ".join(writers)}')
+    return writers[output_format](file_name)
+
+
+class ResultWriter:
+    """
+    Writer of result dataframes to one file chunk by chunk,
+    header is taken from the first dataframe
+    """
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.rows = 0
+        self.sheets = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add_sheet(self, sheet_name):
+        """
+        Start sheet of result file, only xlsx may have several sheets
+        """
+        if self.sheets > 0:
+            raise ValueError(f'{self.__class__.__name__} cannot write '
+                             f'several sheets to one file')
+        self.sheets += 1
+
+    def write(self, data_df):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class XlsxResultWriter(ResultWriter):
+    """
+    Constant memory xlsx writer: xlsxwriter if installed,
+    openpyxl write-only mode otherwise.
+    Workbook for file-like object is made in memory without tmp files.
+    """
+
+    def __init__(self, file_name):
+        super().__init__(file_name)
+        try:
+            import xlsxwriter
+            memory_mode = 'constant_memory' \
+                if isinstance(file_name, str) else 'in_memory'
+            self.workbook = xlsxwriter.Workbook(
+                file_name, {memory_mode: True,
+                            'default_date_format': 'dd.mm.yyyy'})
+        except ImportError:
+            import openpyxl
+            self.workbook = openpyxl.Workbook(write_only=True)
+        self.sheet = None
+
+    def add_sheet(self, sheet_name):
+        # constant memory mode writes previous sheet to file
+        if hasattr(self.workbook, 'add_worksheet'):
+            self.sheet = self.workbook.add_worksheet(sheet_name)
+            self.append = self.append_xlsxwriter
+        else:
+            self.sheet = self.workbook.create_sheet(sheet_name)
+            self.append = self.sheet.append
+        self.sheets += 1
+        self.rows = 0
+
+    def append_xlsxwriter(self, row):
+        self.sheet.write_row(self.rows, 0, row)
+
+    def write(self, data_df):
+        if self.sheet is None:
+            self.add_sheet(DEFAULT_SHEET)
+
+        if self.rows == 0:
+            self.append([None if pd.isna(title) else title
+                         for title in data_df.columns])
+            self.rows += 1
+
+        data_df = data_df.astype(object).where(data_df.notna(), None)
+        for row in data_df.itertuples(index=False, name=None):
+            self.append(row)
+            self.rows += 1
+
+    def close(self):
+        if hasattr(self.workbook, 'close'):
+            self.workbook.close()
+        else:
+            self.workbook.save(self.file_name)
+
+
+class CsvResultWriter(ResultWriter):
+    """
+    CSV writer, utf-8 with BOM for excel
+    """
+
+    def write(self, data_df):
+        data_df.to_csv(self.file_name, index=False,
+                       header=self.rows == 0,
+                       mode='w' if self.rows == 0 else 'a',
+                       encoding='utf-8-sig' if self.rows == 0 else 'utf-8')
+        self.rows += data_df.shape[0]
+
+
+class ParquetResultWriter(ResultWriter):
+    """
+    Parquet writer, needs pyarrow.
+    Types of columns are taken from the first dataframe.
+    """
+
+    def __init__(self, file_name):
+        super().__init__(file_name)
+        self.writer = None
+        self.schema = None
+
+    def open_writer(self, schema):
+        import pyarrow.parquet as pq
+        return pq.ParquetWriter(self.file_name, schema)
+
+    def write(self, data_df):
+        table = arrow_table(data_df, self.schema)
+        if self.writer is None:
+            self.schema = table.schema
+            self.writer = self.open_writer(self.schema)
+        self.writer.write_table(table)
+        self.rows += data_df.shape[0]
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+class FeatherResultWriter(ParquetResultWriter):
+    """
+    Feather (Arrow IPC file) writer, needs pyarrow
+    """
+
+    def open_writer(self, schema):
+        import pyarrow as pa
+        return pa.ipc.new_file(self.file_name, schema)
+
+
+def arrow_table(data_df, schema=None):
+    """
+    Convert result dataframe to arrow table. Text columns are stored as
+    strings, column names are made unique the way pandas reads them.
+    Categorical columns are stored as their values: chunks of streamed
+    sheet have own categories, and IPC file keeps one dictionary
+    of column.
+    :param data_df: result dataframe
+    :param schema: arrow schema of the first dataframe
+    :return: pyarrow.Table
+    """
+    import pyarrow as pa
+
+    titles = unique_titles(data_df.columns)
+    columns = []
+    for ind in range(data_df.shape[1]):
+        column = data_df.iloc[:, ind]
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            column = column.astype(column.cat.categories.dtype)
+        if column.dtype == object or (
+                schema is not None and
+                pa.types.is_string(schema.field(ind).type)):
+            column = column.astype('string')
+        columns.append(pa.array(column, from_pandas=True))
+
+    table = pa.Table.from_arrays(columns, names=titles)
+    if schema is not None:
+        table = table.cast(schema)
+    return table
+
+
+def unique_titles(columns):
+    """
+    Column titles made unique the way pandas reads them:
+    empty title is "Unnamed: N", repeated title is "title.N"
+    :param columns: titles of dataframe columns
+    :return: list of strings
+    """
+    titles = []
+    for ind, title in enumerate(columns):
+        title = f'Unnamed: {ind}' if pd.isna(title) else str(title)
+        if title in titles:
+            title = f'{title}.{titles.count(title)}'
+            while title in titles:
+                title = title + '_'
+        titles.append(title)
+    return titles
+
+
+def is_date(value, fuzzy=False):
+    """
+    Return whether the value can be interpreted as a date.
+
+    :param value: cell value to check for date
+    :param fuzzy: bool, ignore unknown tokens in string if True
+    """
+    if isinstance(value, (datetime.date, np.datetime64)):
+        return not pd.isna(value)
+
+    return is_date_string(str(value), fuzzy)
+
+
+@lru_cache(maxsize=DATE_CACHE_SIZE)
+def is_date_string(string, fuzzy=False):
+    """
+    Return whether the string can be interpreted as a date.
+    Formats of 1C are checked first, dateutil is the last resort.
+
+    :param string: str, string to check for date
+    :param fuzzy: bool, ignore unknown tokens in string if True
+    """
+    match = DATE_PATTERN.match(string)
+    if match:
+        day, month, year = (int(part) for part in match.groups())
+        if year < 100:
+            year = year + 2000
+        for day_, month_ in ((day, month), (month, day)):
+            try:
+                datetime.date(year, month_, day_)
+                return True
+            except ValueError:
+                pass
+
+    # there are no dates without digits in 1C reports
+    if not any(char.isdigit() for char in string):
+        return False
+
+    from dateutil.parser import parse
+
+    try:
+        parse(string, fuzzy=fuzzy)
+        return True
+
+    except (ValueError, OverflowError):
+        return False
+
+
+def dates_mask(values):
+    """
+    Check for date every value, every unique value is checked once
+    :param values: list, array or series of cell values
+    :return: bool series
+    """
+    values = pd.Series(values, dtype=object)
+    uniques = values.unique()
+    return values.map(dict(zip(uniques, map(is_date, uniques)))).astype(bool)
+
+
+def convert(source, config=None, categories=None):
+    """
+    Convert 1C report in memory. No folders of config are used,
+    so it may be called many times from a long-lived process.
+    Workbook with several report sheets gives result of the first one,
+    see convert_sheets.
+    :param source: bytes, binary file-like object or path of report
+    :param config: dict of settings, missing keys are taken
+    from config.yaml
+    :param categories: CategoryRules or lines of categories file,
+    categories.conf by default
+    :return: result dataframe
+    """
+    return next(iter(convert_sheets(source, config, categories).values()))
+
+
+def convert_sheets(source, config=None, categories=None):
+    """
+    Convert every report sheet of 1C workbook in memory, see convert
+    :return: dict {sheet name: result dataframe}
+    """
+    settings = merged_config(config)
+
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        buffer = io.BytesIO(source)
+    elif hasattr(source, 'read'):
+        buffer = io.BytesIO(source.read())
+    else:
+        with open(source, 'rb') as src:
+            buffer = io.BytesIO(src.read())
+
+    if categories is None:
+        rules = get_category_rules(config=settings)
+    elif isinstance(categories, CategoryRules):
+        rules = categories
+    else:
+        rules = compile_categories(categories, settings)
+
+    ext = sniff_format(buffer)
+    if ext is None:
+        raise ValueError('Report is not an excel workbook')
+    if ext != '.xls':
+        fix_shared_strings_name(buffer)
+
+    sheets = report_sheets(
+        read_file_to_dataframe(buffer, ext, sheet_name=None), settings)
+    if not sheets:
+        raise ValueError('Cannot read sheets of workbook')
+    return dict(process_sheets(sheets, settings, rules))
+
+
+def write(data, sink, output_format='xlsx'):
+    """
+    Write result of convert or convert_sheets
+    :param data: result dataframe or dict {sheet name: result dataframe},
+    only xlsx may have several sheets
+    :param sink: path or binary file-like object
+    :param output_format: xlsx, csv, parquet or feather
+    :return:
+    """
+    sheets = data.items() if isinstance(data, dict) \
+        else [(DEFAULT_SHEET, data)]
+    with open_result_writer(sink, output_format) as writer:
+        for sheet_name, data_df in sheets:
+            writer.add_sheet(sheet_name)
+            writer.write(data_df)
+
+
+def merged_config(overrides):
+    """
+    Settings of config.yaml with given values
+    :param overrides: dict of settings or None
+    :return: new dict
+    """
+    return dict(config, **(overrides or {}))
+
+
+def sniff_format(source):
+    """
+    Find excel format by the content of file
+    :param source: path or seekable binary file-like object
+    :return: '.xls', '.xlsx', '.xlsb' or None if it is not excel workbook
+    """
+    if not hasattr(source, 'read'):
+        with open(source, 'rb') as source_file:
+            return sniff_format(source_file)
+
+    source.seek(0)
+    signature = source.read(len(OLE2_SIGNATURE))
+    source.seek(0)
+    if signature == OLE2_SIGNATURE:
+        return '.xls'
+    if not signature.startswith(ZIP_SIGNATURE):
+        return None
+
+    with ZipFile(source) as exl_container:
+        names = exl_container.namelist()
+    source.seek(0)
+    return '.xlsb' if XLSB_WORKBOOK in names else '.xlsx'
+
+
+def delete_tmp_folder(tmp_dir):
+    """
+    Clean folder recursively
+    :param tmp_dir:
+    :return:
+    """
+    logger.debug(f'Cleaning of tmp dir {tmp_dir}')
+
+    for filename in os.listdir(tmp_dir):
+        file_path = os.path.join(tmp_dir, filename)
+        try:
+            if os.path.isfile(file_path) or os.path.islink(file_path):
+                os.unlink(file_path)
+            elif os.path.isdir(file_path):
+                shutil.rmtree(file_path)
+        except Exception as e:
+            logger.error('Failed to delete %s. Reason: %s' % (file_path, e))
+
+
+def remove_source_file(file_to_remove):
+    if config['MOVE_SOURCE'] is True:
+        logger.info(
+            f'Move {os.path.join(SOURCE_FILES_FOLDER, file_to_remove)} '
+            f'to {os.path.join(CONVERTED_FILES_FOLDER, file_to_remove)}')
+
+        shutil.move(os.path.join(SOURCE_FILES_FOLDER, file_to_remove),
+                    os.path.join(CONVERTED_FILES_FOLDER, file_to_remove))
+
+
+def convert_file(file_name, data=None):
+    """
+    Convert one source file. In profile mode metrics of the file
+    are appended to metrics file.
+    :param file_name: file name in SOURCE_FILES_FOLDER
+    :param data: content of source file if it is already read
+    :return: tuple (file_name, success, seconds, error)
+    """
+    global file_metrics
+
+    profiler = None
+    if config.get('PROFILE_FILE'):
+        file_metrics = {'file': file_name, 'stages': {}}
+        if config.get('PROFILE_DUMP_FOLDER'):
+            import cProfile
+            profiler = cProfile.Profile()
+            profiler.enable()
+
+    start_time = time.perf_counter()
+    error = None
+    try:
+        # 1C may save xlsx with .xls extension, format is taken by content
+        source_format = sniff_format(
+            os.path.join(SOURCE_FILES_FOLDER, file_name) if data is None
+            else io.BytesIO(data))
+        if source_format is None:
+            raise ValueError('File is not an excel workbook')
+        if source_format == '.xls':
+            success = xls_processing(file_name, data)
+        else:
+            success = xlsx_processing(file_name, source_format, data)
+    except Exception as e:
+        logger.error(f'Error in processing of {file_name}. Error is {e}')
+        success = False
+        error = str(e)
+    seconds = time.perf_counter() - start_time
+
+    if profiler is not None:
+        profiler.disable()
+        os.makedirs(config['PROFILE_DUMP_FOLDER'], exist_ok=True)
+        profiler.dump_stats(os.path.join(config['PROFILE_DUMP_FOLDER'],
+                                         file_name + '.prof'))
+
+    if file_metrics is not None:
+        file_metrics.update(success=success, error=error, total=seconds,
+                            peak_memory_mb=peak_memory_mb())
+        save_metrics(file_metrics)
+        file_metrics = None
+
+    return file_name, success, seconds, error
+
+
+@contextmanager
+def measure_stage(stage):
+    """
+    Add time of processing stage to metrics of current file,
+    does nothing if profile mode is off. Time of repeated stage is summed.
+    :param stage: name of stage
+    """
+    if file_metrics is None:
+        yield
+        return
+
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        with metrics_lock:
+            stages = file_metrics['stages']
+            stages[stage] = stages.get(stage, 0.0) \
+                + time.perf_counter() - start_time
+
+
+def measure_iteration(iterable, stage):
+    """
+    Add time of getting items of iterable to metrics of current file
+    :param iterable: iterable, e.g. generator of rows
+    :param stage: name of stage
+    :return: iterator
+    """
+    if file_metrics is None:
+        return iter(iterable)
+
+    def measured():
+        iterator = iter(iterable)
+        while True:
+            with measure_stage(stage):
+                item = next(iterator, StopIteration)
+            if item is StopIteration:
+                return
+            yield item
+
+    return measured()
+
+
+def set_metrics(**values):
+    """
+    Set values to metrics of current file in profile mode
+    """
+    if file_metrics is not None:
+        file_metrics.update(values)
+
+
+def add_metrics(**values):
+    """
+    Add values to metrics of current file in profile mode
+    """
+    if file_metrics is None:
+        return
+    with metrics_lock:
+        for key, value in values.items():
+            file_metrics[key] = file_metrics.get(key, 0) + value
+
+
+def peak_memory_mb():
+    """
+    Peak resident memory of current process. Workers convert many files,
+    so it is the peak of all files converted by the process so far.
+    :return: megabytes or None if unknown
+    """
+    try:
+        import resource
+    except ImportError:
+        # windows
+        try:
+            import psutil
+        except ImportError:
+            return None
+        return psutil.Process().memory_info().peak_wset / 1024 / 1024
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macOS
+    if sys.platform == 'darwin':
+        peak = peak / 1024
+    return peak / 1024
+
+
+def save_metrics(metrics):
+    """
+    Append metrics of file as JSON line to file of --profile option.
+    Line is written with one call, so workers do not mix lines.
+    :param metrics: dict of file metrics
+    :return:
+    """
+    metrics = dict(metrics, time=datetime.datetime.now().isoformat(
+        timespec='seconds'), pid=os.getpid())
+    stages = ', '.join(f'{stage} {seconds:.2f} s'
+                       for stage, seconds in metrics['stages'].items())
+    logger.info(f'Profile of {metrics["file"]}: {stages}')
+
+    try:
+        with open(config['PROFILE_FILE'], 'at', encoding='utf8') as f:
+            f.write(json.dumps(metrics, ensure_ascii=False) + '\n')
+    except OSError as e:
+        logger.error(f'Cannot write metrics to {config["PROFILE_FILE"]}. '
+                     f'Error is {e}')
+
+
+def result_file_path(file_name):
+    """
+    Result file of source file
+    :param file_name: file name in SOURCE_FILES_FOLDER
+    :return: path in RESULT_FILES_FOLDER
+    """
+    return os.path.join(RESULT_FILES_FOLDER,
+                        os.path.splitext(file_name)[0] + '.'
+                        + config.get('OUTPUT_FORMAT', 'xlsx'))
+
+
+class ResultCache:
+    """
+    Results of converted files by hash of source file, config,
+    categories and converter code. Manifest is kept in cache folder,
+    least recently used results are removed above max size.
+    Cache is used only by the parent process.
+    """
+
+    def __init__(self, folder, max_size):
+        self.folder = folder
+        self.max_size = max_size
+        self.manifest_file = os.path.join(folder, 'manifest.json')
+        os.makedirs(folder, exist_ok=True)
+
+        self.manifest = {}
+        if os.path.exists(self.manifest_file):
+            try:
+                with open(self.manifest_file, 'rt', encoding='utf8') as f:
+                    self.manifest = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.error(f'Cannot read cache manifest, cache is reset. '
+                             f'Error is {e}')
+
+        self.code_hash = file_hash(__file__)
+
+    def key(self, source_path):
+        """
+        Cache key of source file with current settings
+        """
+        key_hash = hashlib.sha256()
+        for path in (source_path, CONFIG_FILE, CATEGORIES_FILE):
+            key_hash.update(file_hash(path).encode())
+        key_hash.update(self.code_hash.encode())
+        return key_hash.hexdigest()
+
+    def restore(self, key, result_path):
+        """
+        Copy cached result to result path
+        :return: True if result was in cache
+        """
+        entry = self.manifest.get(key)
+        if entry is None:
+            return False
+
+        cached_file = os.path.join(self.folder, entry['file'])
+        try:
+            shutil.copyfile(cached_file, result_path)
+        except OSError as e:
+            logger.error(f'Cannot restore {result_path} from cache. '
+                         f'Error is {e}')
+            del self.manifest[key]
+            return False
+
+        entry['used'] = time.time()
+        self.save()
+        return True
+
+    def store(self, key, result_path):
+        """
+        Copy result to cache and remove old results above max size
+        """
+        cached_name = key + os.path.splitext(result_path)[1]
+        try:
+            shutil.copyfile(result_path,
+                            os.path.join(self.folder, cached_name))
+        except OSError as e:
+            logger.error(f'Cannot store {result_path} to cache. '
+                         f'Error is {e}')
+            return
+
+        self.manifest[key] = {'file': cached_name,
+                              'size': os.path.getsize(result_path),
+                              'used': time.time()}
+
+        total = sum(entry['size'] for entry in self.manifest.values())
+        for old_key, entry in sorted(self.manifest.items(),
+                                     key=lambda item: item[1]['used']):
+            if total <= self.max_size or old_key == key:
+                break
+            try:
+                os.remove(os.path.join(self.folder, entry['file']))
+            except OSError:
+                pass
+            total -= entry['size']
+            del self.manifest[old_key]
+
+        self.save()
+
+    def save(self):
+        tmp_file = self.manifest_file + '.tmp'
+        with open(tmp_file, 'wt', encoding='utf8') as f:
+            json.dump(self.manifest, f)
+        os.replace(tmp_file, self.manifest_file)
+
+
+def file_hash(path):
+    """
+    sha256 of file content
+    """
+    content_hash = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(COPY_BUFFER_SIZE), b''):
+            content_hash.update(block)
+    return content_hash.hexdigest()
+
+
+def open_result_cache(use_cache):
+    """
+    Create result cache if it is configured and not disabled.
+    Result taken from cache is not added to parsed cache and store,
+    so result cache is not used with them.
+    :param use_cache: False if --no-cache option is set
+    :return: ResultCache or None
+    """
+    if not use_cache or not config.get('CACHE_FOLDER'):
+        return None
+    if config.get('PARSED_CACHE_FOLDER') or config.get('STORE_FILE'):
+        logger.info('Result cache is not used with PARSED_CACHE_FOLDER '
+                    'or STORE_FILE, every file is converted')
+        return None
+    return ResultCache(config_path(config['CACHE_FOLDER']),
+                       config.get('CACHE_MAX_SIZE_MB', 1024) * 1024 * 1024)
+
+
+class ResultStore:
+    """
+    Consolidated SQLite store of records of all converted reports.
+    Records are tagged with source file, sheet and period (month of
+    record date), totals of hryvnia sums by operation and account pair
+    are updated with every report. Report converted again replaces
+    its records. Store may be shared by worker processes.
+    """
+
+    def __init__(self, path, config=config):
+        import sqlite3
+
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self.config = config
+        # transactions are opened explicitly
+        self.connection = sqlite3.connect(path, timeout=STORE_TIMEOUT,
+                                          isolation_level=None)
+        self.connection.executescript(STORE_SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def replace(self, source_file, sheets):
+        """
+        Replace records of report in one transaction
+        :param source_file: name of source file
+        :param sheets: iterable of (sheet name, iterable of result
+        dataframes)
+        :return: number of stored records
+        """
+        self.connection.execute('BEGIN IMMEDIATE')
+        try:
+            self.update_totals(source_file, -1)
+            self.connection.execute('DELETE FROM records '
+                                    'WHERE source_file = ?', (source_file,))
+
+            records = 0
+            for sheet_name, frames in sheets:
+                for data_df in frames:
+                    records += self.append(source_file, sheet_name, data_df)
+
+            self.update_totals(source_file, 1)
+            self.connection.execute(
+                'INSERT OR REPLACE INTO sources VALUES (?, ?, ?)',
+                (source_file, records,
+                 datetime.datetime.now().isoformat(timespec='seconds')))
+            self.connection.execute('COMMIT')
+        except BaseException:
+            self.connection.execute('ROLLBACK')
+            raise
+        return records
+
+    def append(self, source_file, sheet_name, data_df):
+        """
+        Insert records of result dataframe
+        :return: number of inserted records
+        """
+        column_names = self.config['COLUMN_NAMES']
+        # repeated titles, e.g. two count columns, get own keys,
+        # not suffixed titles are the first columns of the title
+        keys = unique_titles(data_df.columns)
+        # values of cells as JSON types, dates as ISO strings
+        rows = json.loads(data_df.to_json(orient='values', date_format='iso',
+                                          force_ascii=False))
+
+        positions = dict((column, keys.index(column_names[column])
+                          if column_names.get(column) in keys else None)
+                         for column in STORE_COLUMNS)
+        # hryvnia sum of credit follows credit account like the debet
+        # one, the title of sum_hrn_credit is shifted by currency columns
+        # of credit and stays on the first of them
+        credit_position = positions['credit']
+        if credit_position is not None and \
+                credit_position + 1 < len(keys) and \
+                positions['sum_hrn_credit'] != credit_position + 1:
+            if positions['currency_credit'] is None:
+                positions['currency_credit'] = positions['sum_hrn_credit']
+            positions['sum_hrn_credit'] = credit_position + 1
+        date_position = next((keys.index(title) for title
+                              in self.config['DATE_COLUMN_IN']
+                              if title in keys), None)
+        dates = [None] * len(rows) if date_position is None \
+            else record_dates(data_df.iloc[:, date_position])
+
+        self.connection.executemany(
+            'INSERT INTO records VALUES '
+            '(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            ((source_file, sheet_name, date and date[:7], date,
+              *(None if position is None else row[position]
+                for position in positions.values()),
+              json.dumps(dict(zip(keys, row)), ensure_ascii=False))
+             for row, date in zip(rows, dates)))
+        return len(rows)
+
+    def update_totals(self, source_file, sign):
+        """
+        Add (sign 1) or subtract (sign -1) sums of report records
+        from totals by operation and account pair
+        """
+        self.connection.execute(
+            'INSERT INTO totals '
+            'SELECT COALESCE(operation, \'\'), COALESCE(debet, 0), '
+            'COALESCE(credit, 0), ? * TOTAL(sum_hrn_deb), '
+            '? * TOTAL(sum_hrn_credit), ? * COUNT(*) '
+            'FROM records WHERE source_file = ? GROUP BY 1, 2, 3 '
+            'ON CONFLICT (operation, debet, credit) DO UPDATE SET '
+            'sum_hrn_deb = sum_hrn_deb + excluded.sum_hrn_deb, '
+            'sum_hrn_credit = sum_hrn_credit + excluded.sum_hrn_credit, '
+            'records = records + excluded.records',
+            (sign, sign, sign, source_file))
+        self.connection.execute('DELETE FROM totals WHERE records <= 0')
+
+
+def store_report(source_name, sheets):
+    """
+    Replace records of report in consolidated store if STORE_FILE is set
+    :param source_name: name of source file
+    :param sheets: list of (sheet name, function returning iterable
+    of result dataframes)
+    :return:
+    """
+    if not config.get('STORE_FILE'):
+        return
+
+    with measure_stage('store'):
+        store = ResultStore(config_path(config['STORE_FILE']))
+        try:
+            records = store.replace(source_name,
+                                    ((sheet_name, frames())
+                                     for sheet_name, frames in sheets))
+        finally:
+            store.close()
+    logger.info(f'{records} records of {source_name} are stored')
+
+
+def record_dates(values):
+    """
+    Dates of records as ISO strings, 1C dates are dd.mm.yyyy
+    :param values: series of date cells
+    :return: list of strings, None for not a date
+    """
+    def iso_date(value):
+        if isinstance(value, (datetime.date, np.datetime64)):
+            return None if pd.isna(value) \
+                else pd.Timestamp(value).date().isoformat()
+        match = DATE_PATTERN.match(str(value))
+        if not match:
+            return None
+        day, month, year = (int(part) for part in match.groups())
+        try:
+            return datetime.date(year + 2000 if year < 100 else year,
+                                 month, day).isoformat()
+        except ValueError:
+            return None
+
+    values = values.astype(object)
+    uniques = values.unique()
+    dates = dict(zip(uniques, map(iso_date, uniques)))
+    return [dates.get(value) for value in values]
+
+
+class ParsedCache:
+    """
+    Paired records of converted reports before categorization. Folder
+    of report has Feather file per sheet, or per chunk of streamed sheet,
+    and manifest with sheet names and column names. Files are not
+    compressed, so they are memory-mapped when read.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+
+    def reports(self):
+        """
+        Names of source files with parsed records
+        """
+        if not os.path.isdir(self.folder):
+            return []
+        return sorted(name for name in os.listdir(self.folder)
+                      if os.path.exists(os.path.join(
+                          self.folder, name, PARSED_MANIFEST)))
+
+    def load(self, source_name, config=config):
+        """
+        Read manifest of report
+        :param source_name: name of source file
+        :param config: settings, config.yaml by default
+        :return: list of (sheet name, list of Feather files, streamed),
+        dict {column name at parsing: current column name}
+        """
+        report_folder = os.path.join(self.folder, source_name)
+        with open(os.path.join(report_folder, PARSED_MANIFEST), 'rt',
+                  encoding='utf8') as f:
+            manifest = json.load(f)
+
+        # result columns are renamed by keys of COLUMN_NAMES
+        old_names = manifest['column_names']
+        renames = {old_names[key]: name
+                   for key, name in config['COLUMN_NAMES'].items()
+                   if key in old_names and old_names[key] != name}
+        sheets = [(sheet['name'],
+                   [os.path.join(report_folder, chunk_file)
+                    for chunk_file in sheet['chunks']],
+                   sheet['stream'])
+                  for sheet in manifest['sheets']]
+        return sheets, renames
+
+    @staticmethod
+    def read(path, renames=None):
+        """
+        Read records saved by ParsedReport
+        :param path: Feather file
+        :param renames: dict {old column name: new column name}
+        :return: result dataframe without operation column
+        """
+        import pickle
+        import pyarrow.feather as feather
+
+        table = feather.read_table(path, memory_map=True)
+        titles = json.loads(table.schema.metadata[b'titles'])
+        pickled = set(json.loads(table.schema.metadata.get(b'pickled',
+                                                           b'[]')))
+        data_df = table.to_pandas(integer_object_nulls=True)
+        data_df.columns = [np.nan if title is None
+                           else (renames or {}).get(title, title)
+                           for title in titles]
+
+        for ind in range(data_df.shape[1]):
+            column = data_df.iloc[:, ind]
+            if ind in pickled:
+                data_df.isetitem(ind, pd.Series(
+                    [pickle.loads(value) for value in column],
+                    index=column.index, dtype=object))
+            # empty text cells are NaN as in read report
+            elif column.dtype == object and column.hasnans:
+                data_df.isetitem(ind, column.where(column.notna(), np.nan))
+        return data_df
+
+
+class ParsedReport:
+    """
+    Records of report being converted, they are written to temporary
+    folder and replace previous records of report by commit.
+    Errors of writing do not stop conversion, records of report
+    are not kept then.
+    """
+
+    def __init__(self, folder, source_name):
+        os.makedirs(folder, exist_ok=True)
+        self.source_name = source_name
+        self.report_folder = os.path.join(folder, source_name)
+        self.tmp_folder = tempfile.mkdtemp(prefix='.tmp_', dir=folder)
+        self.sheets = {}
+        self.failed = False
+        self.lock = threading.Lock()
+
+    def sheet_writer(self, ind, sheet_name, stream=False):
+        """
+        Function saving records of sheet, streamed sheet is saved
+        by chunks
+        :param ind: position of sheet in report
+        :param sheet_name: name of sheet
+        :param stream: records are processed by chunks
+        :return: function of result dataframe without operation column
+        """
+        with self.lock:
+            sheet = self.sheets[ind] = {'name': sheet_name, 'chunks': [],
+                                        'stream': stream}
+
+        def save(data_df):
+            if self.failed:
+                return
+            chunk_file = f'{ind}_{len(sheet["chunks"])}.feather'
+            try:
+                save_parsed(os.path.join(self.tmp_folder, chunk_file),
+                            data_df)
+            except Exception as e:
+                self.fail(e)
+                return
+            sheet['chunks'].append(chunk_file)
+
+        return save
+
+    def remove_sheet(self, ind):
+        """
+        Forget records of sheet which is not converted
+        """
+        with self.lock:
+            sheet = self.sheets.pop(ind)
+        for chunk_file in sheet['chunks']:
+            try:
+                os.remove(os.path.join(self.tmp_folder, chunk_file))
+            except OSError as e:
+                self.fail(e)
+
+    def fail(self, error):
+        """
+        Stop saving records of report, warning is logged once
+        """
+        with self.lock:
+            if self.failed:
+                return
+            self.failed = True
+        logger.warning(f'Records of {self.source_name} are not kept '
+                       f'in parsed cache. Error is {error}')
+
+    def commit(self, config=config):
+        """
+        Write manifest and replace previous records of report
+        """
+        if self.failed:
+            self.discard()
+            return
+
+        manifest = {'sheets': [self.sheets[ind]
+                               for ind in sorted(self.sheets)],
+                    'column_names': config['COLUMN_NAMES']}
+        try:
+            with open(os.path.join(self.tmp_folder, PARSED_MANIFEST), 'wt',
+                      encoding='utf8') as f:
+                json.dump(manifest, f, ensure_ascii=False, indent=1)
+
+            old_folder = None
+            if os.path.exists(self.report_folder):
+                old_folder = self.tmp_folder + '_old'
+                os.replace(self.report_folder, old_folder)
+            os.replace(self.tmp_folder, self.report_folder)
+            if old_folder is not None:
+                shutil.rmtree(old_folder, ignore_errors=True)
+        except OSError as e:
+            self.fail(e)
+            self.discard()
+
+    def discard(self):
+        """
+        Remove records of failed conversion, does nothing after commit
+        """
+        shutil.rmtree(self.tmp_folder, ignore_errors=True)
+
+
+def save_parsed(path, data_df):
+    """
+    Write records to Feather file keeping types of cells. Column titles
+    may be repeated or empty, so they are kept in metadata of file.
+    Cells of column with values of different types, e.g. a number
+    in text column or spaces in numbers column, are pickled one by one.
+    :param path: Feather file
+    :param data_df: result dataframe without operation column
+    :return:
+    """
+    import pickle
+    import pyarrow as pa
+    import pyarrow.feather as feather
+
+    columns = []
+    pickled = []
+    for ind in range(data_df.shape[1]):
+        column = data_df.iloc[:, ind]
+        if column.dtype != object or \
+                len(set(map(type, column.dropna()))) <= 1:
+            try:
+                columns.append(pa.array(column, from_pandas=True))
+                continue
+            except (pa.ArrowInvalid, pa.ArrowTypeError,
+                    pa.ArrowNotImplementedError):
+                pass
+        pickled.append(ind)
+        columns.append(pa.array([pickle.dumps(value) for value in column],
+                                type=pa.binary()))
+
+    titles = [None if pd.isna(title) else title
+              for title in data_df.columns]
+    table = pa.Table.from_arrays(
+        columns, names=[str(ind) for ind in range(len(columns))],
+        metadata={'titles': json.dumps(titles, ensure_ascii=False,
+                                       default=str),
+                  'pickled': json.dumps(pickled)})
+    feather.write_feather(table, path, compression='uncompressed')
+
+
+def open_parsed_report(source_name):
+    """
+    Start saving records of report if PARSED_CACHE_FOLDER is set
+    :param source_name: name of source file
+    :return: ParsedReport or None
+    """
+    if not config.get('PARSED_CACHE_FOLDER') or not pyarrow_installed():
+        return None
+    try:
+        return ParsedReport(config_path(config['PARSED_CACHE_FOLDER']),
+                            source_name)
+    except OSError as e:
+        logger.warning(f'Records of {source_name} are not kept in parsed '
+                       f'cache. Error is {e}')
+        return None
+
+
+@lru_cache(maxsize=None)
+def pyarrow_installed():
+    """
+    Check pyarrow needed by parsed cache, warning is logged once
+    """
+    try:
+        import pyarrow
+    except ImportError:
+        logger.warning('pyarrow is not installed, records of reports '
+                       'are not kept in parsed cache')
+        return False
+    return True
+
+
+def restore_cached_files(files, cache):
+    """
+    Take results of already converted identical files from cache
+    :param files: list of file names in SOURCE_FILES_FOLDER
+    :param cache: ResultCache or None
+    :return: tuple (results of restored files, files to convert,
+    dict {file name: cache key})
+    """
+    if cache is None:
+        return [], files, {}
+
+    results = []
+    to_convert = []
+    keys = {}
+    for file_name in files:
+        start_time = time.perf_counter()
+        key = cache.key(os.path.join(SOURCE_FILES_FOLDER, file_name))
+        if cache.restore(key, result_file_path(file_name)):
+            logger.info(f'{file_name} is taken from cache')
+            remove_source_file(file_name)
+            results.append((file_name, True,
+                            time.perf_counter() - start_time, None))
+        else:
+            keys[file_name] = key
+            to_convert.append(file_name)
+
+    return results, to_convert, keys
+
+
+def finish_conversion(result, cache=None, keys=None):
+    """
+    Move converted source file and store result to cache
+    :param result: convert_file result
+    :param cache: ResultCache or None
+    :param keys: dict {file name: cache key}
+    :return:
+    """
+    if not result[1]:
+        return
+
+    file_name = result[0]
+    result_path = result_file_path(file_name)
+    # results written per sheet are not cached
+    if cache is not None and file_name in keys \
+            and os.path.exists(result_path):
+        cache.store(keys[file_name], result_path)
+    remove_source_file(file_name)
+
+
+def convert_files(files, workers, logger_level, config_overrides=None,
+                  cache=None):
+    """
+    Convert files one by one or in process pool
+    :param files: list of file names in SOURCE_FILES_FOLDER
+    :param workers: number of processes
+    :param logger_level: log level for worker processes
+    :param config_overrides: config values for worker processes
+    :param cache: ResultCache or None
+    :return: list of convert_file results
+    """
+    results, files, keys = restore_cached_files(files, cache)
+
+    if workers <= 1 or len(files) <= 1:
+        for file_name in files:
+            result = convert_file(file_name)
+            finish_conversion(result, cache, keys)
+            results.append(result)
+        return results
+
+    logger.info(f'Start {workers} workers for {len(files)} files')
+    with ProcessPoolExecutor(max_workers=workers,
+                             initializer=init_worker,
+                             initargs=(logger_level,
+                                       config_overrides)) as executor:
+        futures = {executor.submit(convert_file, file_name): file_name
+                   for file_name in files}
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                # worker process died
+                result = (futures[future], False, 0.0, str(e))
+            finish_conversion(result, cache, keys)
+            results.append(result)
+
+    return results
+
+
+def convert_source(file_name, data):
+    """
+    Convert source file read to memory, results are kept in memory.
+    Runs in worker of pipeline mode.
+    :param file_name: file name in SOURCE_FILES_FOLDER
+    :param data: content of source file
+    :return: tuple (convert_file result, dict {result path: bytes})
+    """
+    global result_buffers
+
+    result_buffers = {}
+    try:
+        result = convert_file(file_name, data)
+        return result, result_buffers if result[1] else {}
+    finally:
+        result_buffers = None
+
+
+def save_results(result, buffers, cache=None, keys=None):
+    """
+    Write results of file converted in memory and move its source file
+    :param result: convert_file result
+    :param buffers: dict {result path: bytes}
+    :param cache: ResultCache or None
+    :param keys: dict {file name: cache key}
+    :return: convert_file result, failed if results cannot be written
+    """
+    def save(data):
+        def write(path):
+            with open(path, 'wb') as f:
+                f.write(data)
+        return write
+
+    try:
+        for path, data in buffers.items():
+            write_locked_file(path, save(data))
+    except Exception as e:
+        return result[0], False, result[2], str(e)
+
+    finish_conversion(result, cache, keys)
+    return result
+
+
+class MemoryBudget:
+    """
+    Bytes of files kept in memory by pipeline. Reading of next file
+    waits while budget is used, one file above budget is let through
+    alone, so any file can be converted.
+    """
+
+    def __init__(self, limit):
+        import asyncio
+
+        self.limit = limit
+        self.used = 0
+        self.condition = asyncio.Condition()
+
+    async def acquire(self, size):
+        async with self.condition:
+            await self.condition.wait_for(
+                lambda: self.used == 0 or self.used + size <= self.limit)
+            self.used += size
+
+    def take(self, size):
+        """
+        Count memory which is already used, does not wait
+        """
+        self.used += size
+
+    async def release(self, size):
+        async with self.condition:
+            self.used -= size
+            self.condition.notify_all()
+
+
+async def run_pipeline(files, executor, workers, cache=None, keys=None):
+    """
+    Overlap stages of conversion: the next source files are read
+    to memory, the current ones are converted by executor, results
+    of previous ones are written and their source files are moved.
+    Queues between stages are bounded, reading waits for memory budget.
+    :param files: list of file names in SOURCE_FILES_FOLDER
+    :param executor: executor of conversions
+    :param workers: number of conversions at once
+    :param cache: ResultCache or None
+    :param keys: dict {file name: cache key}
+    :return: list of convert_file results
+    """
+    import asyncio
+
+    loop = asyncio.get_running_loop()
+    budget = MemoryBudget(config.get('PIPELINE_MEMORY_MB', 512) * 1024 * 1024)
+    sources = asyncio.Queue(maxsize=workers)
+    outputs = asyncio.Queue(maxsize=workers)
+    results = []
+
+    def read_source(path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    async def prefetch():
+        for file_name in files:
+            path = os.path.join(SOURCE_FILES_FOLDER, file_name)
+            try:
+                size = os.path.getsize(path)
+                await budget.acquire(size)
+                try:
+                    data = await loop.run_in_executor(None, read_source, path)
+                except OSError:
+                    await budget.release(size)
+                    raise
+            except OSError as e:
+                logger.error(f'Cannot read {file_name}. Error is {e}')
+                results.append((file_name, False, 0.0, str(e)))
+                continue
+            await sources.put((file_name, data))
+        for _ in range(workers):
+            await sources.put(None)
+
+    async def convert():
+        while (item := await sources.get()) is not None:
+            file_name, data = item
+            try:
+                result, buffers = await loop.run_in_executor(
+                    executor, convert_source, file_name, data)
+            except Exception as e:
+                # worker process died
+                result, buffers = (file_name, False, 0.0, str(e)), {}
+            await budget.release(len(data))
+            del item, data
+
+            # results are in memory already, so they are counted
+            # without waiting
+            size = sum(len(data) for data in buffers.values())
+            budget.take(size)
+            await outputs.put((result, buffers, size))
+
+    async def write():
+        while (item := await outputs.get()) is not None:
+            result, buffers, size = item
+            result = await loop.run_in_executor(
+                None, save_results, result, buffers, cache, keys)
+            await budget.release(size)
+            del item, buffers
+            results.append(result)
+
+    converters = [asyncio.create_task(convert()) for _ in range(workers)]
+    writer = asyncio.create_task(write())
+    await prefetch()
+    await asyncio.gather(*converters)
+    await outputs.put(None)
+    await writer
+    return results
+
+
+def pipeline_files(files, workers, logger_level, config_overrides=None,
+                   cache=None):
+    """
+    Convert files with overlapped reading, conversion and writing,
+    see run_pipeline. One conversion runs in a thread, several
+    in process pool.
+    :param files: list of file names in SOURCE_FILES_FOLDER
+    :param workers: number of processes
+    :param logger_level: log level for worker processes
+    :param config_overrides: config values for worker processes
+    :param cache: ResultCache or None
+    :return: list of convert_file results
+    """
+    import asyncio
+
+    results, files, keys = restore_cached_files(files, cache)
+    if not files:
+        return results
+
+    workers = max(workers, 1)
+    if workers == 1:
+        executor = ThreadPoolExecutor(max_workers=1)
+    else:
+        logger.info(f'Start {workers} workers for {len(files)} files')
+        executor = ProcessPoolExecutor(max_workers=workers,
+                                       initializer=init_worker,
+                                       initargs=(logger_level,
+                                                 config_overrides))
+    with executor:
+        results += asyncio.run(run_pipeline(files, executor, workers,
+                                            cache, keys))
+    return results
+
+
+def recategorize_report(source_name):
+    """
+    Make result of report again from its records in parsed cache with
+    current categories.conf and config, source file is not read.
+    In profile mode metrics of the report are appended to metrics file.
+    :param source_name: name of source file
+    :return: tuple (source_name, success, seconds, error)
+    """
+    global file_metrics
+
+    if config.get('PROFILE_FILE'):
+        file_metrics = {'file': source_name, 'stages': {},
+                        'recategorize': True}
+
+    start_time = time.perf_counter()
+    error = None
+    spill_dir = tempfile.mkdtemp(prefix='recategorize_', dir=work_tmp_folder)
+    try:
+        cache = ParsedCache(config_path(config['PARSED_CACHE_FOLDER']))
+        sheets, renames = cache.load(source_name)
+        rules = get_category_rules()
+
+        results = []
+        for ind, (sheet_name, chunk_files, stream) in enumerate(sheets):
+            if not stream:
+                with measure_stage('read'):
+                    data_df = cache.read(chunk_files[0], renames)
+                data_df = finish_records(data_df, rules=rules)
+                results.append((sheet_name,
+                                lambda data_df=data_df: [data_df]))
+                continue
+
+            # streamed sheet is processed by chunks again
+            spill = ChunkSpill(os.path.join(spill_dir, str(ind)),
+                               rules=rules)
+            os.mkdir(spill.spill_dir)
+            for chunk_file in chunk_files:
+                with measure_stage('read'):
+                    data_df = cache.read(chunk_file, renames)
+                spill.add(data_df)
+            results.append((sheet_name,
+                            lambda spill=spill: iter_result_chunks(
+                                *spill.chunks())))
+
+        with measure_stage('write'):
+            write_report_sheets(os.path.join(RESULT_FILES_FOLDER,
+                                             source_name), results)
+        store_report(source_name, results)
+        success = True
+    except Exception as e:
+        logger.error(f'Error in recategorization of {source_name}. '
+                     f'Error is {e}')
+        success = False
+        error = str(e)
+    finally:
+        shutil.rmtree(spill_dir, ignore_errors=True)
+    seconds = time.perf_counter() - start_time
+
+    if file_metrics is not None:
+        file_metrics.update(success=success, error=error, total=seconds,
+                            peak_memory_mb=peak_memory_mb())
+        save_metrics(file_metrics)
+        file_metrics = None
+
+    return source_name, success, seconds, error
+
+
+def recategorize_reports(workers, logger_level, config_overrides=None):
+    """
+    Make results of all reports in parsed cache again, e.g. after
+    categories.conf or COLUMN_NAMES are changed
+    :param workers: number of processes
+    :param logger_level: log level for worker processes
+    :param config_overrides: config values for worker processes
+    :return: list of recategorize_report results
+    """
+    if not config.get('PARSED_CACHE_FOLDER'):
+        logger.error('PARSED_CACHE_FOLDER is not set in config')
+        return []
+
+    reports = ParsedCache(
+        config_path(config['PARSED_CACHE_FOLDER'])).reports()
+    logger.info(f'Recategorize {len(reports)} reports')
+    if workers <= 1 or len(reports) <= 1:
+        return [recategorize_report(source_name) for source_name in reports]
+
+    with ProcessPoolExecutor(max_workers=workers,
+                             initializer=init_worker,
+                             initargs=(logger_level,
+                                       config_overrides)) as executor:
+        return list(executor.map(recategorize_report, reports))
+
+
+def watch_folder(workers, logger_level, config_overrides=None, cache=None):
+    """
+    Convert files coming to SOURCE_FILES_FOLDER until interrupted.
+    Folder changes are received from inotify if inotify_simple is
+    installed, otherwise folder is polled. Workers are started once
+    and keep libraries, config and categories loaded.
+    :param workers: number of processes
+    :param logger_level: log level for worker processes
+    :param config_overrides: config values for worker processes
+    :param cache: ResultCache or None
+    :return:
+    """
+    try:
+        from inotify_simple import INotify, flags
+        inotify = INotify()
+        inotify.add_watch(SOURCE_FILES_FOLDER,
+                          flags.CLOSE_WRITE | flags.MOVED_TO | flags.CREATE
+                          | flags.MODIFY)
+        logger.info(f'Watch {SOURCE_FILES_FOLDER} with inotify')
+    except (ImportError, OSError):
+        inotify = None
+        logger.info(f'Watch {SOURCE_FILES_FOLDER} '
+                    f'every {WATCH_POLL_INTERVAL} s')
+
+    # {file name: (size, mtime, time of last change)}
+    seen = {}
+    # {file name: (size, mtime)} of converted and failed files
+    finished = {}
+    running = {}
+
+    with ProcessPoolExecutor(max_workers=max(workers, 1),
+                             initializer=init_worker,
+                             initargs=(logger_level,
+                                       config_overrides)) as executor:
+        try:
+            while True:
+                now = time.monotonic()
+                current = set()
+                for file_name in os.listdir(SOURCE_FILES_FOLDER):
+                    if not file_name.endswith(SOURCE_EXTENSIONS) or \
+                            file_name in running:
+                        continue
+                    try:
+                        stat = os.stat(os.path.join(SOURCE_FILES_FOLDER,
+                                                    file_name))
+                    except OSError:
+                        continue
+                    current.add(file_name)
+                    signature = (stat.st_size, stat.st_mtime_ns)
+                    if finished.get(file_name) == signature:
+                        continue
+                    if seen.get(file_name, (None, None, None))[:2] \
+                            != signature:
+                        seen[file_name] = signature + (now,)
+                    elif now - seen[file_name][2] >= WATCH_SETTLE_SECONDS:
+                        del seen[file_name]
+                        logger.info(f'New file {file_name}')
+                        restored, to_convert, keys = restore_cached_files(
+                            [file_name], cache)
+                        if restored:
+                            finished[file_name] = signature
+                            continue
+                        running[file_name] = (
+                            signature, keys.get(file_name),
+                            executor.submit(convert_file, file_name))
+
+                # removed files
+                for file_name in set(seen) - current:
+                    del seen[file_name]
+                for file_name in set(finished) - current:
+                    del finished[file_name]
+
+                for file_name, (signature, key, future) in \
+                        list(running.items()):
+                    if not future.done():
+                        continue
+                    del running[file_name]
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        result = (file_name, False, 0.0, str(e))
+                    finish_conversion(result, cache, {file_name: key})
+                    if result[1]:
+                        logger.info(f'Converted {file_name} '
+                                    f'in {result[2]:.1f} s')
+                    else:
+                        logger.error(f'Failed: {file_name}'
+                                     + (f': {result[3]}' if result[3]
+                                        else ''))
+                    finished[file_name] = signature
+
+                if inotify is not None and not (seen or running):
+                    # nothing to wait for, sleep until folder is changed
+                    inotify.read(timeout=WATCH_IDLE_TIMEOUT * 1000)
+                else:
+                    time.sleep(WATCH_POLL_INTERVAL)
+        except KeyboardInterrupt:
+            logger.info('Stop watching')
+            for signature, key, future in running.values():
+                future.cancel()
+
+
+def convert_upload(data, output_format):
+    """
+    Convert uploaded report in worker process of HTTP service
+    :param data: bytes of report
+    :param output_format: xlsx, csv, parquet or feather
+    :return: bytes of result file
+    """
+    sheets = convert_sheets(data)
+    result = io.BytesIO()
+    write(sheets if len(sheets) > 1 else next(iter(sheets.values())),
+          result, output_format)
+    return result.getvalue()
+
+
+def warm_worker():
+    """
+    Load readers and writers of all formats before the first request
+    :return: process id
+    """
+    for module in ('openpyxl', 'xlrd', 'xlsxwriter', 'pyarrow'):
+        try:
+            __import__(module)
+        except ImportError:
+            pass
+    return os.getpid()
+
+
+def upload_content(content_type, body):
+    """
+    Take report from request body: body is the file itself
+    or multipart/form-data with the file in the first file field
+    :param content_type: Content-Type header of request
+    :param body: bytes of request body
+    :return: tuple (file name or None, bytes of file)
+    """
+    from email.message import Message
+
+    header = Message()
+    header['Content-Type'] = content_type or 'application/octet-stream'
+    if header.get_content_type() != 'multipart/form-data':
+        return None, body
+
+    boundary = header.get_param('boundary')
+    if not boundary:
+        raise ValueError('No boundary of multipart/form-data')
+
+    for part in body.split(b'--' + boundary.encode('latin-1'))[1:-1]:
+        head, _, content = part.partition(b'\r\n\r\n')
+        part_header = Message()
+        for line in head.decode('utf8', 'replace').split('\r\n'):
+            if ':' in line:
+                name, value = line.split(':', 1)
+                part_header[name.strip()] = value.strip()
+        file_name = part_header.get_filename()
+        if file_name is not None:
+            # part ends with line break before the next boundary
+            return file_name, content[:-2]
+
+    raise ValueError('No file in form data')
+
+
+class ConversionService:
+    """
+    Worker pool, limits and metrics of HTTP service.
+    Workers are started at once and keep libraries, config and
+    compiled categories loaded. Conversions above the limit are
+    rejected, slot is free when worker finishes the conversion.
+    """
+
+    def __init__(self, workers, logger_level, config_overrides=None):
+        self.workers = max(workers, 1)
+        self.logger_level = logger_level
+        self.config_overrides = config_overrides
+        self.max_upload = config.get('SERVE_MAX_UPLOAD_MB', 100) * 1024 * 1024
+        self.timeout = config.get('SERVE_TIMEOUT', 120)
+        self.slots = threading.BoundedSemaphore(
+            config.get('SERVE_MAX_REQUESTS') or self.workers)
+
+        self.lock = threading.Lock()
+        # {format: list of counts by LATENCY_BUCKETS and +Inf}
+        self.latency_counts = {}
+        self.latency_sum = {}
+        # {(format, status): count}
+        self.responses = {}
+        self.in_flight = 0
+        self.upload_bytes = 0
+
+        self.executor = self.start_pool()
+
+    def start_pool(self):
+        executor = ProcessPoolExecutor(max_workers=self.workers,
+                                       initializer=init_worker,
+                                       initargs=(self.logger_level,
+                                                 self.config_overrides))
+        # start all workers now, not on the first requests
+        pids = {future.result() for future in
+                [executor.submit(warm_worker) for _ in range(self.workers)]}
+        logger.info(f'Started {len(pids)} workers')
+        return executor
+
+    def convert(self, data, output_format):
+        """
+        Convert report in worker pool. Slot is taken by caller before
+        the upload is read, it is free when worker finishes.
+        :param data: bytes of report
+        :param output_format: xlsx, csv, parquet or feather
+        :return: tuple (HTTP status, content type, bytes of response)
+        """
+        executor = self.executor
+        try:
+            future = executor.submit(convert_upload, data, output_format)
+        except BrokenProcessPool:
+            self.slots.release()
+            self.restart_pool(executor)
+            return 500, 'text/plain', b'Worker pool is restarted'
+        future.add_done_callback(lambda _: self.slots.release())
+
+        try:
+            return 200, CONTENT_TYPES[output_format], \
+                future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            return 504, 'text/plain', b'Conversion takes too long'
+        except BrokenProcessPool:
+            self.restart_pool(executor)
+            return 500, 'text/plain', b'Worker process died'
+        except Exception as e:
+            logger.error(f'Cannot convert upload. Error is {e}')
+            return 422, 'text/plain; charset=utf-8', \
+                f'Cannot convert report: {e}'.encode('utf8')
+
+    def restart_pool(self, broken_executor):
+        """
+        Replace broken pool, once for all requests that used it
+        """
+        with self.lock:
+            if self.executor is not broken_executor:
+                return
+            logger.error('Worker process died, restart worker pool')
+            broken_executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = self.start_pool()
+
+    def observe(self, output_format, status, seconds, size):
+        """
+        Add conversion request to metrics
+        """
+        with self.lock:
+            counts = self.latency_counts.setdefault(
+                output_format, [0] * (len(LATENCY_BUCKETS) + 1))
+            for ind, bucket in enumerate(LATENCY_BUCKETS):
+                if seconds <= bucket:
+                    counts[ind] += 1
+            counts[-1] += 1
+            self.latency_sum[output_format] = \
+                self.latency_sum.get(output_format, 0.0) + seconds
+            key = (output_format, status)
+            self.responses[key] = self.responses.get(key, 0) + 1
+            self.upload_bytes += size
+
+    def render_metrics(self):
+        """
+        Metrics in Prometheus text format
+        """
+        name = 'converter_request_duration_seconds'
+        lines = [f'# HELP {name} Time of conversion requests',
+                 f'# TYPE {name} histogram']
+        with self.lock:
+            for output_format, counts in sorted(self.latency_counts.items()):
+                for bucket, count in zip(LATENCY_BUCKETS + ('+Inf',), counts):
+                    lines.append(f'{name}_bucket{{format="{output_format}",'
+                                 f'le="{bucket}"}} {count}')
+                lines.append(f'{name}_sum{{format="{output_format}"}} '
+                             f'{self.latency_sum[output_format]:.6f}')
+                lines.append(f'{name}_count{{format="{output_format}"}} '
+                             f'{counts[-1]}')
+
+            lines += ['# HELP converter_requests_total Conversion requests '
+                      'by response status',
+                      '# TYPE converter_requests_total counter']
+            for (output_format, status), count in \
+                    sorted(self.responses.items()):
+                lines.append(f'converter_requests_total{{format='
+                             f'"{output_format}",status="{status}"}} {count}')
+
+            lines += ['# TYPE converter_requests_in_flight gauge',
+                      f'converter_requests_in_flight {self.in_flight}',
+                      '# TYPE converter_upload_bytes_total counter',
+                      f'converter_upload_bytes_total {self.upload_bytes}']
+        return ('\n'.join(lines) + '\n').encode('utf8')
+
+
+def serve(workers, logger_level, config_overrides=None, port=None):
+    """
+    Run HTTP service until interrupted.
+    POST /convert?format=xlsx|csv|parquet|feather with report as body
+    or multipart/form-data file returns converted file,
+    GET /metrics returns metrics in Prometheus text format.
+    :param workers: number of worker processes
+    :param logger_level: log level for worker processes
+    :param config_overrides: config values for worker processes
+    :param port: port, SERVE_PORT from config by default
+    :return:
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from urllib.parse import urlsplit, parse_qs, quote
+
+    service = ConversionService(workers, logger_level, config_overrides)
+
+    class RequestHandler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            if urlsplit(self.path).path == '/metrics':
+                self.respond(200, 'text/plain; version=0.0.4',
+                             service.render_metrics())
+            else:
+                self.respond(404, 'text/plain', b'Not found')
+
+        def do_POST(self):
+            url = urlsplit(self.path)
+            if url.path != '/convert':
+                self.respond(404, 'text/plain', b'Not found')
+                return
+
+            output_format = parse_qs(url.query).get(
+                'format', [config.get('OUTPUT_FORMAT', 'xlsx')])[0]
+            if output_format not in CONTENT_TYPES:
+                self.respond(400, 'text/plain',
+                             f'Unknown format, use one of '
+                             f'{", ".join(CONTENT_TYPES)}'.encode())
+                return
+
+            length = self.headers.get('Content-Length')
+            if length is None or not length.isdigit():
+                self.respond(411, 'text/plain', b'Content-Length is needed')
+                return
+            if int(length) > service.max_upload:
+                self.close_connection = True
+                self.respond(413, 'text/plain', b'File is too large')
+                return
+
+            start_time = time.perf_counter()
+            # slot is taken before the upload is read,
+            # so rejected uploads are not kept in memory
+            if not service.slots.acquire(blocking=False):
+                self.close_connection = True
+                self.respond(503, 'text/plain',
+                             b'Too many conversions, try later')
+                service.observe(output_format, 503,
+                                time.perf_counter() - start_time,
+                                int(length))
+                return
+
+            with service.lock:
+                service.in_flight += 1
+            try:
+                try:
+                    file_name, data = upload_content(
+                        self.headers.get('Content-Type'),
+                        self.rfile.read(int(length)))
+                except BaseException:
+                    service.slots.release()
+                    raise
+                status, content_type, body = service.convert(data,
+                                                             output_format)
+            except ValueError as e:
+                status, content_type, body = 400, 'text/plain', \
+                    str(e).encode('utf8')
+            finally:
+                with service.lock:
+                    service.in_flight -= 1
+
+            headers = {}
+            if status == 200:
+                result_name = os.path.splitext(file_name or 'result')[0] \
+                    + '.' + output_format
+                headers['Content-Disposition'] = \
+                    f"attachment; filename*=UTF-8''{quote(result_name)}"
+            self.respond(status, content_type, body, headers)
+            service.observe(output_format, status,
+                            time.perf_counter() - start_time, int(length))
+
+        def respond(self, status, content_type, body, headers=None):
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug(f'{self.address_string()} {format % args}')
+
+    host = config.get('SERVE_HOST', '127.0.0.1')
+    port = port or config.get('SERVE_PORT', 8080)
+    server = ThreadingHTTPServer((host, port), RequestHandler)
+    # service manager stops service by SIGTERM
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    logger.info(f'Serve on http://{host}:{port}/convert')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info('Stop service')
+    finally:
+        server.server_close()
+        service.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def log_summary(results, elapsed):
+    """
+    Print throughput and failed files
+    :param results: list of convert_file results
+    :param elapsed: wall time of all conversions in seconds
+    :return:
+    """
+    failed = [result for result in results if not result[1]]
+    converted = len(results) - len(failed)
+    rate = len(results) / elapsed if elapsed > 0 else 0.0
+
+    logger.info(f'Converted {converted} of {len(results)} files '
+                f'in {elapsed:.1f} s ({rate:.2f} files/s)')
+    for file_name, _, seconds, error in failed:
+        logger.error(f'Failed: {file_name} ({seconds:.1f} s)'
+                     + (f': {error}' if error else ''))
+
+
+if __name__ == '__main__':
+    args = parse_args()
+
+    log_level = args.log_level
+
+    set_logger(logger, log_level)
+
+    # Create tmp folder if not exists
+    os.makedirs(TMP_FOLDER, exist_ok=True)
+
+    overrides = {'STREAM_CHUNK_ROWS': args.stream_chunk_rows,
+                 'PROFILE_FILE': args.metrics_file,
+                 'PROFILE_DUMP_FOLDER': args.profile_dump_folder}
+    config.update(overrides)
+
+    result_cache = open_result_cache(args.use_cache)
+
+    if args.serve:
+        serve(args.workers, log_level, overrides, args.port)
+        delete_tmp_folder(TMP_FOLDER)
+        exit()
+
+    if args.watch:
+        watch_folder(args.workers, log_level, overrides, result_cache)
+        delete_tmp_folder(TMP_FOLDER)
+        exit()
+
+    batch_start = time.perf_counter()
+    if args.recategorize:
+        batch_results = recategorize_reports(args.workers, log_level,
+                                             overrides)
+    else:
+        source_files = [file_name
+                        for file_name in os.listdir(SOURCE_FILES_FOLDER)
+                        if file_name.endswith(SOURCE_EXTENSIONS)]
+        batch = pipeline_files if args.pipeline else convert_files
+        batch_results = batch(source_files, args.workers, log_level,
+                              overrides, result_cache)
+    log_summary(batch_results, time.perf_counter() - batch_start)
+
+    delete_tmp_folder(TMP_FOLDER)
+
+    logger.info('DONE!')
+
+    # wait only for user at console, not for scheduler
+    if sys.stdin.isatty():
+        time.sleep(0.1)
+        print('\a')
+        input('Press ENTER to exit')
     exit()
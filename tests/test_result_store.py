@@ -0,0 +1,33 @@
+import pandas as pd
+import pytest
+
+import main
+from benchmarks.generate import report_rows
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = main.ResultStore(str(tmp_path / 'store.sqlite'))
+    yield store
+    store.close()
+
+
+def test_totals_have_credit_sums(store):
+    rows = list(report_rows(300))
+    # records are rows with debet and credit accounts
+    records = [row for row in rows if isinstance(row[6], int)]
+    data_df = main.process_dataframe(pd.DataFrame(rows))
+
+    assert store.replace('card.xlsx', [('Sheet1', [data_df])]) == \
+        len(records)
+
+    sum_deb, sum_credit = store.connection.execute(
+        'SELECT TOTAL(sum_hrn_deb), TOTAL(sum_hrn_credit) '
+        'FROM totals').fetchone()
+    assert sum_credit != 0
+    assert sum_credit == pytest.approx(sum(row[7] for row in records))
+    assert sum_deb == pytest.approx(sum(row[5] for row in records))
+
+    currencies = {currency for currency, in store.connection.execute(
+        'SELECT DISTINCT currency_credit FROM records')}
+    assert currencies <= {None, 'USD', 'EUR', 'PLN'}